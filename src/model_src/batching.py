@@ -0,0 +1,102 @@
+# src/batching.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class QueueFullError(Exception):
+    """
+    等待队列已满，调用方应拒绝请求（例如返回 HTTP 429）
+    """
+
+
+class MicroBatcher:
+    """
+    动态微批处理：在一个很短的时间窗口内收集并发请求，合并成一个批次运行模型，
+    再把每张图片的结果分发回对应的请求
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5, max_queue_size=64):
+        """
+        Args:
+            predict_fn: 接收 (N, C, H, W) 张量、返回长度为 N 的结果列表的函数；
+                批次中有图片需要解释时额外传入 explain=[每张图片是否需要解释]
+            max_batch_size (int): 单个批次的最大图片数
+            max_wait_ms (float): 收到第一张图片后最多等待多久凑批次（毫秒）
+            max_queue_size (int): 等待执行的图片数上限，超出时 submit 抛出 QueueFullError；0 表示不限
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._stopping = False
+        self.worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.worker.start()
+
+    def submit(self, tensor, explain=False):
+        """
+        提交单张图片 (C, H, W)，返回 Future，结果为该图片的预测结果
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait((tensor, explain, future))
+        except queue.Full:
+            raise QueueFullError(f"等待队列已满 ({self.queue.maxsize})")
+        return future
+
+    def predict(self, tensor, explain=False, timeout=None):
+        """
+        提交单张图片并阻塞等待结果
+        """
+        return self.submit(tensor, explain).result(timeout=timeout)
+
+    def close(self):
+        """
+        停止后台线程，已在队列中的请求会先处理完
+        """
+        self.queue.put(None)
+        self.worker.join()
+
+    def _collect(self, first):
+        """
+        以第一张图片为起点，在时间窗口内尽量凑满一个批次
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止信号已取出，处理完当前批次后直接退出
+                self._stopping = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            batch = self._collect(item)
+            futures = [future for _, _, future in batch]
+            explain = [flag for _, flag, _ in batch]
+            try:
+                inputs = torch.stack([tensor for tensor, _, _ in batch])
+                # 没有图片需要解释时保持原来的调用方式
+                results = self.predict_fn(inputs, explain=explain) if any(explain) else self.predict_fn(inputs)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,94 @@
+# src/benchmark_decode.py
+
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+
+from PIL import Image
+
+from preprocessing import ResizeAndPad, open_image
+
+
+def decode_full(path, size):
+    """原始做法：完整分辨率解码后再缩放"""
+    return ResizeAndPad(size)(Image.open(path).convert('RGB'))
+
+
+def decode_reduced(path, size):
+    """解码阶段降分辨率后再缩放"""
+    return ResizeAndPad(size)(open_image(path, size))
+
+
+MODES = {
+    'full': decode_full,
+    'reduced': decode_reduced,
+}
+
+
+def _run_mode(mode, paths, size, repeat, conn):
+    # 在子进程中运行，保证每种方式的峰值内存互不影响
+    decode = MODES[mode]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = {}
+    for path in paths:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            decode(path, size)
+        timings[path] = (time.perf_counter() - start) / repeat
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 下 ru_maxrss 的单位是 KB
+    conn.send((timings, (peak_rss - baseline_rss) / 1024))
+    conn.close()
+
+
+def make_synthetic_images(output_dir):
+    """
+    生成 12MP 和 48MP 的测试 JPEG（模拟手机照片）
+    """
+    paths = []
+    for name, size in [('12mp', (4000, 3000)), ('48mp', (8000, 6000))]:
+        path = os.path.join(output_dir, f'{name}.jpg')
+        # 使用渐变图像，避免纯噪声导致 JPEG 体积异常
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比完整解码与降分辨率解码的耗时和峰值内存")
+    parser.add_argument('images', nargs='*', help='测试图片路径，不指定时生成 12MP/48MP 测试图片')
+    parser.add_argument('--size', type=int, default=224, help='模型输入尺寸')
+    parser.add_argument('--repeat', type=int, default=5, help='每张图片重复解码的次数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = args.images or make_synthetic_images(tmp_dir)
+        size = (args.size, args.size)
+
+        results = {}
+        ctx = mp.get_context('spawn')
+        for mode in MODES:
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_run_mode, args=(mode, paths, size, args.repeat, child_conn))
+            process.start()
+            results[mode] = parent_conn.recv()
+            process.join()
+
+    print(f"{'image':<30}{'mode':<10}{'decode (ms)':>14}")
+    for path in paths:
+        for mode in MODES:
+            timings, _ = results[mode]
+            print(f"{os.path.basename(path):<30}{mode:<10}{timings[path] * 1000:>14.1f}")
+    print()
+    print(f"{'mode':<10}{'peak RSS increase (MB)':>24}")
+    for mode in MODES:
+        _, peak_mb = results[mode]
+        print(f"{mode:<10}{peak_mb:>24.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# src/evaluation/engine.py
+
+import argparse
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+
+from src.evaluation.logits_store import (LogitsStore, LogitsWriter, check_store_loader, checkpoint_key, dataset_key,
+                                         ensemble_probs, threshold_report)
+from src.models import MODEL_BUILDERS, build_model
+from src.models.weights import find_checkpoint, load_weights
+from src.utils.data_loader import get_data_loaders, load_loader_config
+from src.utils.loader_stats import LoaderStallMonitor
+from src.utils.metrics import MetricAccumulator
+from src.utils.visualization import save_metrics_to_csv
+
+MODEL_DISPLAY_NAMES = {
+    'efficientnet_b0': 'EfficientNet-B0',
+    'mobilenet_v3_large': 'MobileNetV3-Large',
+    'resnet50': 'ResNet-50',
+    'ensemble': 'Ensemble',
+}
+
+ENSEMBLE_NAME = 'ensemble'
+
+
+def find_model_checkpoints(model_names, experiments_dir='../../experiments'):
+    """
+    查找各模型训练好的权重文件，返回 {模型名称: 路径}，缺少检查点的模型会被跳过
+    """
+    checkpoints = {}
+    for model_name in model_names:
+        model_path = find_checkpoint(os.path.join(experiments_dir, model_name, 'checkpoints'))
+        if not os.path.exists(model_path):
+            print(f"模型检查点文件 {model_path} 未找到，跳过 {MODEL_DISPLAY_NAMES[model_name]}")
+            continue
+        checkpoints[model_name] = model_path
+    return checkpoints
+
+
+def load_models(checkpoints, num_classes, device='cpu'):
+    """
+    按 {模型名称: 路径} 加载模型
+    """
+    models = {}
+    for model_name, model_path in checkpoints.items():
+        # 随后会加载训练好的权重，无需 ImageNet 预训练权重
+        model = build_model(model_name, num_classes, pretrained=False)
+        models[model_name] = load_weights(model, model_path, device)
+    return models
+
+
+@torch.no_grad()
+def evaluate_models(models, loader, num_classes, device='cpu', ensemble=True, on_batch=None):
+    """
+    只遍历一次验证集：每个批次依次送入所有模型，并计算各模型 softmax 概率的平均作为集成结果
+
+    每个模型（及集成）使用一个 MetricAccumulator 在设备上累加 top-1/top-5、混淆矩阵等，
+    同时记录每个模型前向的耗时。on_batch(batch_idx, outputs) 可用于保存每个批次的 logits，
+    outputs 为 {模型名称: logits}
+    返回 ({模型名称: 指标}, LoaderStallMonitor)
+    """
+    names = list(models) + ([ENSEMBLE_NAME] if ensemble and len(models) > 1 else [])
+    accumulators = {name: MetricAccumulator(num_classes, device=device) for name in names}
+    forward_seconds = dict.fromkeys(models, 0.0)
+    monitor = LoaderStallMonitor()
+
+    for batch_idx, (inputs, labels) in enumerate(tqdm(monitor.wrap(loader), desc='评估中', total=len(loader))):
+        inputs = inputs.to(device)
+        labels = labels.to(device)
+
+        outputs = {}
+        prob_sum = None
+        for name, model in models.items():
+            since = time.perf_counter()
+            logits = model(inputs)
+            if logits.is_cuda:
+                torch.cuda.synchronize()
+            forward_seconds[name] += time.perf_counter() - since
+
+            accumulators[name].update(logits, labels, F.cross_entropy(logits, labels))
+            outputs[name] = logits
+            probs = logits.float().softmax(dim=1)
+            prob_sum = probs if prob_sum is None else prob_sum + probs
+
+        if ENSEMBLE_NAME in accumulators:
+            avg_probs = prob_sum / len(models)
+            loss = F.nll_loss(avg_probs.clamp_min(1e-12).log(), labels)
+            accumulators[ENSEMBLE_NAME].update(avg_probs, labels, loss)
+
+        if on_batch is not None:
+            on_batch(batch_idx, outputs)
+
+    results = {}
+    for name, accumulator in accumulators.items():
+        stats = accumulator.compute()
+        if name in forward_seconds:
+            stats['ms_per_image'] = forward_seconds[name] * 1000 / max(stats['count'], 1)
+        else:
+            # 集成的耗时为各模型之和
+            stats['ms_per_image'] = sum(forward_seconds.values()) * 1000 / max(stats['count'], 1)
+        results[name] = stats
+    return results, monitor
+
+
+def evaluate_scores(scores, labels, num_classes, probs=False, chunk_size=4096):
+    """
+    由保存好的 logits（probs=True 时为概率）计算与 evaluate_models 相同的指标，不需要运行模型
+    """
+    accumulator = MetricAccumulator(num_classes)
+    for start in range(0, len(labels), chunk_size):
+        outputs = torch.from_numpy(np.array(scores[start:start + chunk_size], dtype=np.float32))
+        targets = torch.from_numpy(np.array(labels[start:start + chunk_size]))
+        if probs:
+            loss = F.nll_loss(outputs.clamp_min(1e-12).log(), targets)
+        else:
+            loss = F.cross_entropy(outputs, targets)
+        accumulator.update(outputs, targets, loss)
+    return accumulator.compute()
+
+
+def evaluate_with_store(checkpoints, loader, num_classes, store, device='cpu', ensemble=True):
+    """
+    只对 logits 库中没有结果（数据集或权重有变化）的模型运行前向并写入库，然后全部从库中计算指标
+
+    loader 必须按顺序读取 ImageFolder 验证集（get_data_loaders 不指定 cache_dir / tar_dir）。
+    返回 ({模型名称: 指标}, {模型名称: LogitsEntry})
+    """
+    check_store_loader(loader)
+    dataset = loader.dataset
+    data_key = dataset_key(dataset)
+    ckpt_keys = {name: checkpoint_key(path) for name, path in checkpoints.items()}
+    missing = {name: path for name, path in checkpoints.items()
+               if store.lookup(name, data_key, ckpt_keys[name]) is None}
+
+    if missing:
+        print(f"运行模型: {', '.join(missing)}；其余模型使用已保存的 logits")
+        models = load_models(missing, num_classes, device)
+        writer = LogitsWriter(store, models, dataset, data_key, ckpt_keys)
+        fresh, monitor = evaluate_models(models, loader, num_classes, device, ensemble=False, on_batch=writer)
+        writer.close({name: {'ms_per_image': stats['ms_per_image']} for name, stats in fresh.items()})
+        print(f'数据加载: {monitor.format_summary()}')
+    else:
+        print("所有模型的 logits 均已保存，跳过前向")
+
+    entries = {name: store.lookup(name, data_key, ckpt_keys[name]) for name in checkpoints}
+    results = {}
+    for name, entry in entries.items():
+        results[name] = evaluate_scores(entry.logits, entry.labels, num_classes)
+        results[name]['ms_per_image'] = entry.manifest.get('ms_per_image', float('nan'))
+    if ensemble and len(entries) > 1:
+        labels = next(iter(entries.values())).labels
+        results[ENSEMBLE_NAME] = evaluate_scores(ensemble_probs(list(entries.values())), labels, num_classes,
+                                                 probs=True)
+        results[ENSEMBLE_NAME]['ms_per_image'] = sum(results[name]['ms_per_image'] for name in entries)
+    return results, entries
+
+
+def save_report(results, class_names, output_dir):
+    """
+    保存三份 CSV：汇总指标 evaluation_report.csv、每类精确率 / 召回率 per_class_metrics.csv，
+    以及每个模型的混淆矩阵 confusion_<模型>.csv
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {'model': [], 'valid_loss': [], 'top1_acc': [], 'top5_acc': [],
+               'macro_precision': [], 'macro_recall': [], 'ms_per_image': []}
+    per_class = {'class': list(class_names)}
+    for name, stats in results.items():
+        summary['model'].append(MODEL_DISPLAY_NAMES.get(name, name))
+        summary['valid_loss'].append(stats['loss'])
+        summary['top1_acc'].append(stats['top1_acc'])
+        summary['top5_acc'].append(stats['top5_acc'])
+        summary['macro_precision'].append(float(stats['precision'].mean()))
+        summary['macro_recall'].append(float(stats['recall'].mean()))
+        summary['ms_per_image'].append(stats['ms_per_image'])
+
+        per_class[f'{name}_precision'] = stats['precision'].tolist()
+        per_class[f'{name}_recall'] = stats['recall'].tolist()
+
+        confusion = {'true_class': list(class_names)}
+        for j, class_name in enumerate(class_names):
+            confusion[class_name] = stats['confusion'][:, j].tolist()
+        save_metrics_to_csv(confusion, os.path.join(output_dir, f'confusion_{name}.csv'))
+
+    per_class['support'] = next(iter(results.values()))['support'].tolist()
+    save_metrics_to_csv(summary, os.path.join(output_dir, 'evaluation_report.csv'))
+    save_metrics_to_csv(per_class, os.path.join(output_dir, 'per_class_metrics.csv'))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="一次遍历验证集评估多个模型及其集成")
+    parser.add_argument('--models', nargs='+', default=list(MODEL_BUILDERS), choices=list(MODEL_BUILDERS))
+    parser.add_argument('--train-dir', default='../../data/train')
+    parser.add_argument('--valid-dir', default='../../data/valid')
+    parser.add_argument('--experiments-dir', default='../../experiments')
+    parser.add_argument('--output-dir', default='../../experiments/evaluation')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--no-ensemble', dest='ensemble', action='store_false', help='不计算集成结果')
+    parser.add_argument('--store-dir', default='../../experiments/logits_store',
+                        help='保存每张图片 logits 和特征的目录，数据集和权重未变化时直接复用')
+    parser.add_argument('--no-store', dest='use_store', action='store_false', help='不读写 logits 库')
+    args = parser.parse_args(argv)
+
+    loader_config = load_loader_config(batch_size=args.batch_size)
+    if args.use_store:
+        # logits 库按图片路径建立指纹并按顺序逐行保存，直接从 ImageFolder 顺序读取验证集
+        for key in ('cache_dir', 'tar_dir'):
+            if loader_config.pop(key, None) is not None:
+                print(f"使用 logits 库时忽略数据加载配置中的 {key}，直接读取 {args.valid_dir}")
+    dataloaders, class_names = get_data_loaders(args.train_dir, args.valid_dir, **loader_config)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    checkpoints = find_model_checkpoints(args.models, args.experiments_dir)
+    if not checkpoints:
+        print("没有可评估的模型，请先训练模型。")
+        return
+
+    if args.use_store:
+        results, entries = evaluate_with_store(checkpoints, dataloaders['valid'], len(class_names),
+                                               LogitsStore(args.store_dir), device, ensemble=args.ensemble)
+        if len(entries) > 1:
+            # 集成结果在不同置信度阈值下的覆盖率和准确率
+            labels = next(iter(entries.values())).labels
+            report = threshold_report(ensemble_probs(list(entries.values())), labels)
+            os.makedirs(args.output_dir, exist_ok=True)
+            save_metrics_to_csv(report, os.path.join(args.output_dir, 'ensemble_thresholds.csv'))
+    else:
+        models = load_models(checkpoints, len(class_names), device)
+        results, monitor = evaluate_models(models, dataloaders['valid'], len(class_names), device,
+                                           ensemble=args.ensemble)
+        print(f'数据加载: {monitor.format_summary()}')
+
+    summary = save_report(results, class_names, args.output_dir)
+    print(f"{'模型':<20}{'Loss':>8}{'Top-1':>8}{'Top-5':>8}{'ms/张':>8}")
+    for i, model_name in enumerate(summary['model']):
+        print(f"{model_name:<20}{summary['valid_loss'][i]:>8.4f}{summary['top1_acc'][i]:>8.4f}"
+              f"{summary['top5_acc'][i]:>8.4f}{summary['ms_per_image'][i]:>8.2f}")
+    print(f'评估报告已保存到 {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
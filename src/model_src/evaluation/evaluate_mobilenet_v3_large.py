@@ -1,5 +1,6 @@
 # src/evaluation/evaluate_mobilenet_v3_large.py
 
+import argparse
 import os
 import torch
 import torch.nn as nn
@@ -12,20 +13,20 @@ import matplotlib.pyplot as plt
 import numpy as np
 from torch.utils.tensorboard import SummaryWriter
 
-from src.utils.data_loader import get_data_loaders
+from src.utils.data_loader import get_data_loaders, load_loader_config
+from src.utils.feature_capture import FeatureCapture, sample_name
+from src.utils.loader_stats import LoaderStallMonitor
 from src.models.mobilenet_v3_large import get_model
-from src.utils.metrics import calculate_accuracy
-from src.utils.visualization import save_metrics_to_csv
+from src.utils.metrics import MetricAccumulator
+from src.utils.visualization import FeatureGridExporter, save_metrics_to_csv
+from src.models.weights import load_weights
 
 
 def load_model(model, model_path, device='cpu'):
     """
     加载模型权重
     """
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model = model.to(device)
-    model.eval()
-    return model
+    return load_weights(model, model_path, device)
 
 
 def save_original_image(image_tensor, img_name, output_dir='../../outputs/feature_maps/mobilenet_v3_large/original_images'):
@@ -49,41 +50,27 @@ def save_original_image(image_tensor, img_name, output_dir='../../outputs/featur
     return image_np
 
 
-def save_feature_map(feature_map, layer_name, img_name, channel_idx, block_output_dir, writer):
-    """
-    保存特征图为图片，并记录到 TensorBoard
-    """
-    os.makedirs(block_output_dir, exist_ok=True)
-    feature_map = feature_map.cpu().numpy()
-
-    # 选择特征图的指定通道
-    channel = feature_map[channel_idx]
-
-    plt.figure(figsize=(5, 5))
-    plt.imshow(channel, cmap='viridis')
-    plt.axis('off')
-    plt.title(f'{layer_name} - Channel {channel_idx} - {img_name}')
-    save_path = os.path.join(block_output_dir, f'{img_name}_{layer_name}_channel{channel_idx}.png')
-    plt.savefig(save_path)
-    plt.close()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="评估 MobileNetV3-Large 并保存选中图片的特征图")
+    parser.add_argument('--feature-images', nargs='*', type=int, default=[0],
+                        help='保存特征图的验证集图片下标（默认第一张），不给出下标时不保存特征图')
+    parser.add_argument('--feature-layers', nargs='+', default=None, help='保存特征图的层，默认所有 block')
+    parser.add_argument('--feature-index', action='store_true',
+                        help='在每张特征图网格旁保存记录各通道位置和取值范围的 JSON')
+    args = parser.parse_args(argv)
 
-    # 将特征图记录到 TensorBoard
-    writer.add_image(f'{layer_name}/Channel_{channel_idx}/{img_name}', channel, dataformats='HW')
-
-
-def main():
     # 定义数据路径
     train_dir = '../../data/train'
     valid_dir = '../../data/valid'
 
-    # 获取数据加载器和类别名称
-    dataloaders, class_names = get_data_loaders(train_dir, valid_dir, batch_size=8, num_workers=0)
+    # 获取数据加载器和类别名称（worker 数等可通过 DATA_LOADER_CONFIG 指定的 JSON 文件配置）
+    dataloaders, class_names = get_data_loaders(train_dir, valid_dir, **load_loader_config(batch_size=8))
 
     # 获取类别数量
     num_classes = len(class_names)
 
-    # 获取模型
-    model = get_model(num_classes)
+    # 获取模型（随后会加载训练好的权重，无需 ImageNet 预训练权重）
+    model = get_model(num_classes, pretrained=False)
 
     # 加载训练好的模型权重
     model_path = '../../experiments/mobilenet_v3_large/checkpoints/best_model.pth'
@@ -98,28 +85,13 @@ def main():
 
     # 定义需要捕获特征图的层名称
     # MobileNetV3-Large 的 blocks 通常包括 features.0, features.1, ..., features.n
-    target_layers = [f'features.{i}' for i in range(len(model.features))]
+    target_layers = args.feature_layers or [f'features.{i}' for i in range(len(model.features))]
 
     # 初始化 TensorBoard
     writer = SummaryWriter(log_dir='../../experiments/mobilenet_v3_large/features_tensorboard')
 
-    # 定义一个字典来存储特征图
-    feature_maps = {}
-
-    def get_hook(name):
-        def hook(module, input, output):
-            feature_maps[name] = output
-
-        return hook
-
-    # 注册 Hook
-    hooks = []
-    for layer_name in target_layers:
-        if layer_name in dict([*model.named_modules()]):
-            layer = dict([*model.named_modules()])[layer_name]
-            hooks.append(layer.register_forward_hook(get_hook(layer_name)))
-        else:
-            print(f"层 {layer_name} 不存在于模型中。")
+    # 只在包含选中图片的批次上注册 Hook，并且只把这些图片的特征拷贝到 CPU
+    capture = FeatureCapture(model, target_layers, args.feature_images)
 
     # 创建输出目录结构
     blocks_output_dir = '../../outputs/feature_maps/mobilenet_v3_large/features_mobilenet_v3_large'
@@ -129,67 +101,67 @@ def main():
     original_images_dir = '../../outputs/feature_maps/mobilenet_v3_large/original_images'
     os.makedirs(original_images_dir, exist_ok=True)
 
+    # 每层所有通道拼成一张网格图，在后台线程中写文件
+    exporter = FeatureGridExporter(blocks_output_dir, writer, index=args.feature_index)
+
     # 评估模型
-    running_loss = 0.0
-    running_corrects = 0
+    # 损失、top-k 正确数等在设备上累加，评估结束时才取回
+    metric_accumulator = MetricAccumulator(num_classes, device=device)
+
+    monitor = LoaderStallMonitor()
 
-    # 标记是否处理了第一张图片
-    first_image_processed = False
+    # 已处理的图片数，即当前批次第一张图片在验证集中的下标
+    start = 0
 
     with torch.no_grad():
-        for inputs, labels in tqdm(dataloaders['valid'], desc='评估中'):
+        for inputs, labels in tqdm(monitor.wrap(dataloaders['valid']), desc='评估中',
+                                   total=len(dataloaders['valid'])):
             inputs = inputs.to(device)
             labels = labels.to(device)
 
-            outputs = model(inputs)
+            # 批次中没有选中的图片时不注册 Hook，前向与普通推理相同
+            with capture.batch(start, inputs.size(0)) as rows:
+                outputs = model(inputs)
             loss = criterion(outputs, labels)
-            acc = calculate_accuracy(outputs, labels)
-
-            running_loss += loss.item() * inputs.size(0)
-            running_corrects += acc.item() * inputs.size(0)
+            metric_accumulator.update(outputs, labels, loss)
 
-            # 处理每个批次中的每个样本
-            batch_size = inputs.size(0)
-            for i in range(batch_size):
-                img_path, _ = dataloaders['valid'].dataset.imgs[i]
-                img_name = os.path.splitext(os.path.basename(img_path))[0]
+            for position, img_idx in rows:
+                img_name = sample_name(dataloaders['valid'].dataset, img_idx)
 
-                if not first_image_processed:
-                    # 保存原始图像
-                    original_image_np = save_original_image(inputs[i], img_name, original_images_dir)
+                # 保存原始图像
+                original_image_np = save_original_image(inputs[position], img_name, original_images_dir)
 
-                    # 将原始图像记录到 TensorBoard
-                    writer.add_image(f'Original Images/{img_name}', original_image_np, dataformats='HWC')
+                # 将原始图像记录到 TensorBoard
+                writer.add_image(f'Original Images/{img_name}', original_image_np, dataformats='HWC')
 
-                    # 保存和可视化所有 block 的所有通道特征图
-                    for layer_name in target_layers:
-                        if layer_name in feature_maps:
-                            feature = feature_maps[layer_name][i]
-                            block_output_dir = os.path.join(blocks_output_dir, layer_name)
-                            num_channels = feature.size(0)
-                            for channel_idx in range(num_channels):
-                                save_feature_map(feature, layer_name, img_name, channel_idx, block_output_dir, writer)
+                # 保存和可视化选中层的特征图，每层一张网格图
+                for layer_name, feature in capture.pop(img_idx).items():
+                    exporter.export(feature, layer_name, img_name)
 
-                    first_image_processed = True
+            start += inputs.size(0)
 
-    epoch_loss = running_loss / len(dataloaders['valid'].dataset)
-    epoch_acc = running_corrects / len(dataloaders['valid'].dataset)
+    stats = metric_accumulator.compute()
+    epoch_loss = stats['loss']
+    epoch_acc = stats['acc']
 
-    print(f'MobileNetV3-Large 验证集 Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+    print(f'MobileNetV3-Large 验证集 Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} Top-5 Acc: {stats["top5_acc"]:.4f}')
+    print(f'数据加载: {monitor.format_summary()}')
+    print(f'特征图: {capture.format_summary(device)}')
 
     # 保存评估结果到 CSV
     results = {
         'model': ['MobileNetV3-Large'],
         'valid_loss': [epoch_loss],
-        'valid_acc': [epoch_acc]
+        'valid_acc': [epoch_acc],
+        'valid_top5_acc': [stats['top5_acc']]
     }
     csv_path = '../../experiments/mobilenet_v3_large/results/evaluation_results.csv'
     save_metrics_to_csv(results, csv_path)
     print(f'评估结果已保存到 {csv_path}')
 
-    # 移除 Hook
-    for hook in hooks:
-        hook.remove()
+    # 释放尚未取出的特征，等待特征图写完
+    capture.release()
+    exporter.close()
 
     # 关闭 TensorBoard writer
     writer.close()
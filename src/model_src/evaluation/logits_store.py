@@ -0,0 +1,239 @@
+# src/evaluation/logits_store.py
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import SequentialSampler
+from torchvision import datasets
+
+from src.models import get_head_name
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def dataset_key(dataset):
+    """
+    根据 ImageFolder 的样本列表（相对路径、文件大小、修改时间、类别）计算数据集指纹
+    """
+    root = os.path.abspath(dataset.root)
+    entries = []
+    for path, target in dataset.samples:
+        stat = os.stat(path)
+        entries.append([os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns, target])
+    payload = json.dumps({'classes': list(dataset.classes), 'samples': entries}, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def check_store_loader(loader):
+    """
+    logits 库按 ImageFolder 的样本列表建立指纹，并按批次顺序逐行写入结果；
+    数据集不是 ImageFolder（解码缓存、tar 分片）或不是顺序读取时，保存的行与标签、路径对不上，直接报错
+    """
+    if not isinstance(loader.dataset, datasets.DatasetFolder):
+        raise ValueError(f"logits 库只支持 ImageFolder 数据集，当前为 {type(loader.dataset).__name__}")
+    if not isinstance(loader.sampler, SequentialSampler):
+        raise ValueError(f"logits 库要求按顺序读取数据集，当前采样器为 {type(loader.sampler).__name__}")
+
+
+def checkpoint_key(model_path, chunk_size=1 << 20):
+    """
+    计算权重文件内容的 SHA-1
+    """
+    digest = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LogitsEntry:
+    """
+    一个模型在一个数据集上的输出：logits (N, C)、池化特征 embeddings (N, D) 和标签 (N,)，均为内存映射
+    """
+
+    def __init__(self, entry_dir):
+        self.entry_dir = entry_dir
+        with open(os.path.join(entry_dir, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        self.logits = np.load(os.path.join(entry_dir, 'logits.npy'), mmap_mode='r')
+        self.embeddings = np.load(os.path.join(entry_dir, 'embeddings.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(entry_dir, 'labels.npy'))
+
+    @property
+    def model_name(self):
+        return self.manifest['model']
+
+    @property
+    def classes(self):
+        return self.manifest['classes']
+
+    @property
+    def paths(self):
+        return self.manifest['paths']
+
+    def probs(self):
+        return torch.from_numpy(np.array(self.logits, dtype=np.float32)).softmax(dim=1).numpy()
+
+
+class LogitsStore:
+    """
+    按 <模型>/<数据集指纹>_<权重指纹> 保存每张图片的 logits 和特征
+
+    数据集和权重都没有变化时直接复用已保存的结果，不需要重新运行模型
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def entry_dir(self, model_name, data_key, ckpt_key):
+        return os.path.join(self.store_dir, model_name, f'{data_key[:16]}_{ckpt_key[:16]}')
+
+    def lookup(self, model_name, data_key, ckpt_key):
+        """
+        返回已保存的 LogitsEntry，没有时返回 None
+        """
+        entry_dir = self.entry_dir(model_name, data_key, ckpt_key)
+        if not os.path.exists(os.path.join(entry_dir, MANIFEST_NAME)):
+            return None
+        return LogitsEntry(entry_dir)
+
+    def entries(self, model_name=None):
+        """
+        列出已保存的所有结果
+        """
+        model_names = [model_name] if model_name else sorted(os.listdir(self.store_dir))
+        found = []
+        for name in model_names:
+            model_dir = os.path.join(self.store_dir, name)
+            if not os.path.isdir(model_dir):
+                continue
+            for entry_name in sorted(os.listdir(model_dir)):
+                if os.path.exists(os.path.join(model_dir, entry_name, MANIFEST_NAME)):
+                    found.append(LogitsEntry(os.path.join(model_dir, entry_name)))
+        return found
+
+
+class LogitsWriter:
+    """
+    评估时写入 LogitsStore：在分类层上注册 forward pre-hook 截取池化特征，与 logits 一起写入内存映射数组
+
+    与 evaluate_models(on_batch=writer) 配合使用，不需要额外的前向。先写入临时目录，
+    全部完成后再改名，中途退出的结果不会被复用。
+    按批次到达的顺序逐行写入，数据加载器必须按 dataset.samples 的顺序读取（见 check_store_loader）
+    """
+
+    def __init__(self, store, models, dataset, data_key, ckpt_keys):
+        self.store = store
+        self.dataset = dataset
+        self.data_key = data_key
+        self.ckpt_keys = ckpt_keys
+        self.num_samples = len(dataset)
+        self.arrays = {}
+        self.offsets = dict.fromkeys(models, 0)
+        self.embeddings = {}
+        self.hooks = []
+        for name, model in models.items():
+            head = getattr(model, get_head_name(model))
+            self.hooks.append(head.register_forward_pre_hook(self._make_hook(name)))
+
+    def _make_hook(self, name):
+        def hook(module, inputs):
+            self.embeddings[name] = inputs[0].detach().flatten(1)
+        return hook
+
+    def _tmp_dir(self, name):
+        return self.store.entry_dir(name, self.data_key, self.ckpt_keys[name]) + '.tmp'
+
+    def _open(self, name, num_classes, feature_dim):
+        tmp_dir = self._tmp_dir(name)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        logits = np.lib.format.open_memmap(os.path.join(tmp_dir, 'logits.npy'), mode='w+', dtype=np.float32,
+                                           shape=(self.num_samples, num_classes))
+        embeddings = np.lib.format.open_memmap(os.path.join(tmp_dir, 'embeddings.npy'), mode='w+',
+                                               dtype=np.float16, shape=(self.num_samples, feature_dim))
+        return logits, embeddings
+
+    def __call__(self, batch_idx, outputs):
+        for name, logits in outputs.items():
+            embeddings = self.embeddings.pop(name)
+            if name not in self.arrays:
+                self.arrays[name] = self._open(name, logits.size(1), embeddings.size(1))
+            logits_array, embeddings_array = self.arrays[name]
+            offset = self.offsets[name]
+            end = offset + logits.size(0)
+            logits_array[offset:end] = logits.float().cpu().numpy()
+            embeddings_array[offset:end] = embeddings.float().cpu().numpy()
+            self.offsets[name] = end
+
+    def close(self, extra_manifest=None):
+        """
+        写入标签和清单并把临时目录改名为正式目录；extra_manifest 为 {模型名称: 附加信息}（如耗时）
+        """
+        for hook in self.hooks:
+            hook.remove()
+        root = os.path.abspath(self.dataset.root)
+        paths = [os.path.relpath(path, root) for path, _ in self.dataset.samples]
+        for name, (logits, embeddings) in self.arrays.items():
+            if self.offsets[name] != self.num_samples:
+                print(f"{name} 只写入了 {self.offsets[name]}/{self.num_samples} 个样本，不保存")
+                continue
+            logits.flush()
+            embeddings.flush()
+            tmp_dir = self._tmp_dir(name)
+            np.save(os.path.join(tmp_dir, 'labels.npy'), np.array(self.dataset.targets, dtype=np.int64))
+            manifest = {
+                'model': name,
+                'dataset_key': self.data_key,
+                'checkpoint_key': self.ckpt_keys[name],
+                'num_samples': self.num_samples,
+                'classes': list(self.dataset.classes),
+                'paths': paths,
+            }
+            manifest.update((extra_manifest or {}).get(name, {}))
+            with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            entry_dir = self.store.entry_dir(name, self.data_key, self.ckpt_keys[name])
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        self.arrays = {}
+
+
+def ensemble_probs(entries, weights=None):
+    """
+    按权重对多个模型的 softmax 概率加权平均，weights 为 None 时等权
+    """
+    weights = np.ones(len(entries)) if weights is None else np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+    return sum(weight * entry.probs() for weight, entry in zip(weights, entries))
+
+
+def threshold_report(probs, labels, thresholds=(0.5, 0.7, 0.9)):
+    """
+    对每个置信度阈值，统计最高概率不低于阈值的样本比例（覆盖率）和这些样本的准确率
+    """
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == labels
+    report = {'threshold': [], 'coverage': [], 'accuracy': []}
+    for threshold in thresholds:
+        kept = confidence >= threshold
+        report['threshold'].append(threshold)
+        report['coverage'].append(float(kept.mean()))
+        report['accuracy'].append(float(correct[kept].mean()) if kept.any() else float('nan'))
+    return report
+
+
+def misclassified(probs, labels, paths, classes, limit=None):
+    """
+    列出预测错误的样本 (路径, 真实类别, 预测类别, 预测概率)，按预测概率从高到低排列
+    """
+    preds = probs.argmax(axis=1)
+    wrong = np.nonzero(preds != labels)[0]
+    wrong = wrong[np.argsort(-probs[wrong, preds[wrong]])]
+    if limit is not None:
+        wrong = wrong[:limit]
+    return [(paths[i], classes[labels[i]], classes[preds[i]], float(probs[i, preds[i]])) for i in wrong]
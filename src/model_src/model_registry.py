@@ -0,0 +1,223 @@
+# src/model_registry.py
+
+import base64
+import io
+import os
+import threading
+
+import torch
+from PIL import Image
+
+from models import get_head_name, get_last_conv_name
+from models.efficientnet_b0 import get_model as get_efficientnet_b0
+from models.mobilenet_v3_large import get_model as get_mobilenet_v3_large
+from models.resnet50 import get_model as get_resnet50
+from models.fold import fold_input_normalization
+from models.weights import find_checkpoint, load_weights
+from preprocessing import IMAGENET_MEAN, IMAGENET_STD, TensorResizeAndPad, build_test_transforms, open_image
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '../..'))
+
+# (结果中的模型名称, experiments 下的目录名, 模型构建函数)
+MODEL_SPECS = [
+    ('efficientnet', 'efficientnet_b0', get_efficientnet_b0),
+    ('mobilenet', 'mobilenet_v3_large', get_mobilenet_v3_large),
+    ('resnet', 'resnet50', get_resnet50),
+]
+
+
+def load_class_names(class_names_path):
+    """
+    加载类别名称
+    """
+    with open(class_names_path, 'r') as f:
+        return [line.strip() for line in f.readlines()]
+
+
+def result_to_row(result):
+    """
+    将单个模型的预测结果转换为 CSV 行: 模型名, 类别1, 概率1, ..., 其他类别概率
+    """
+    row = [result['model']]
+    for class_name, prob in zip(result['classes'], result['probs']):
+        row.extend([class_name, round(float(prob), 2)])
+    row.append(round(float(result['other_prob']), 2))
+    return row
+
+
+def encode_heatmap(heatmap):
+    """
+    将 [0, 1] 的热力图 (H, W) 编码为灰度 PNG 的 data URL；热力图为最后一个卷积 block 的分辨率（7×7），
+    客户端按原图尺寸拉伸显示即可
+    """
+    image = Image.fromarray((heatmap * 255).round().to(torch.uint8).numpy(), mode='L')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def class_activation_map(head, features, class_idxs):
+    """
+    计算指定类别的 Grad-CAM 热力图，features 为最后一个卷积 block 的输出 (K, C, H, W)，返回 (K, H, W)
+
+    分类层之前只有全局平均池化，特征图各位置对池化向量的梯度相同，Grad-CAM 的通道权重就是
+    类别分数对池化向量的梯度。因此只需对分类层求梯度，不需要在主干网络上再做一次前向或反向
+    （对 ResNet / EfficientNet 的单层 Linear 分类器即为 CAM）
+    """
+    with torch.enable_grad():
+        pooled = features.float().mean(dim=(2, 3)).requires_grad_()
+        scores = head(pooled).gather(1, class_idxs.view(-1, 1)).sum()
+        weights, = torch.autograd.grad(scores, pooled)
+    cam = torch.relu(torch.einsum('kc,kchw->khw', weights, features.float()))
+    return cam / cam.flatten(1).max(dim=1).values.clamp_min(1e-8).view(-1, 1, 1)
+
+
+class ModelRegistry:
+    """
+    常驻内存的模型注册表：进程内只加载一次全部模型，所有请求共用
+
+    fold_normalize=True 时在加载后把 ImageNet Normalize 折叠进每个模型的第一层卷积，
+    预处理只需把像素缩放到 [0, 1]，省去一次整图的归一化计算
+
+    max_explain 为每个批次最多生成热力图的图片数，超出的图片只返回预测结果
+    """
+
+    def __init__(self, project_root=PROJECT_ROOT, device=None, topk=3, fold_normalize=True, max_explain=4):
+        self.project_root = project_root
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.topk = topk
+        self.image_size = (224, 224)
+        self.fold_normalize = fold_normalize
+        self.max_explain = max_explain
+
+        class_names_path = os.path.join(project_root, 'class_names.txt')
+        print(f"类别名称文件路径: {class_names_path}")
+        self.class_names = load_class_names(class_names_path)
+        self.transform = build_test_transforms(self.image_size, normalize=not fold_normalize)
+        if fold_normalize:
+            self.batch_transform = TensorResizeAndPad(self.image_size, mean=None, std=None)
+        else:
+            self.batch_transform = TensorResizeAndPad(self.image_size)
+
+        print(f"使用设备: {self.device}")
+        self.models = {}
+        for name, exp_name, builder in MODEL_SPECS:
+            model_path = find_checkpoint(os.path.join(project_root, 'experiments', exp_name, 'checkpoints'))
+            print(f"加载 {name} 模型: {model_path}")
+            # 不加载 ImageNet 预训练权重，冷启动只读取微调后的检查点
+            model = builder(len(self.class_names), pretrained=False)
+            model = load_weights(model, model_path, self.device)
+            if fold_normalize:
+                model = fold_input_normalization(model, IMAGENET_MEAN, IMAGENET_STD)
+            self.models[name] = model
+
+    def preprocess(self, image):
+        """
+        将 PIL 图像转换为模型输入张量 (C, H, W)
+        """
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return self.transform(image)
+
+    def preprocess_batch(self, images):
+        """
+        将一组 uint8 图像张量 (C, H, W) 一次性处理为模型输入 (N, C, H, W)
+        """
+        return self.batch_transform(images)
+
+    def load_image(self, image_path):
+        """
+        从文件加载并预处理图片
+        """
+        return self.preprocess(open_image(image_path, self.image_size))
+
+    def decode(self, image_bytes):
+        """
+        直接在内存中解码图片字节并预处理，不经过临时文件；大图按需降分辨率解码
+        """
+        return self.preprocess(open_image(io.BytesIO(image_bytes), self.image_size))
+
+    def predict_bytes(self, image_bytes):
+        """
+        预测单张图片的字节数据，返回各模型的 top-k 结果列表
+        """
+        return self.predict(self.decode(image_bytes))[0]
+
+    def _forward(self, model, tensor, rows):
+        """
+        运行一个模型；rows 非空时在同一次前向中截取这些图片在最后一个卷积 block 的输出，
+        返回 (logits, 特征图 (len(rows), C, H, W) 或 None)
+        """
+        if not rows:
+            return model(tensor), None
+        captured = {}
+
+        def hook(module, inputs, output):
+            # 只保留需要解释的图片
+            captured['features'] = output[rows]
+
+        handle = getattr(model, get_last_conv_name(model)).register_forward_hook(hook)
+        try:
+            logits = model(tensor)
+        finally:
+            handle.remove()
+        return logits, captured['features']
+
+    @torch.no_grad()
+    def predict(self, tensor, explain=None):
+        """
+        对 (C, H, W) 或 (N, C, H, W) 的输入运行全部模型
+
+        返回长度为 N 的列表，每个元素是该图片在各模型上的 top-k 结果列表。
+        explain 为每张图片是否需要解释，需要解释的图片的结果中 heatmap 为 top-1 类别的热力图 (H, W)，
+        超出 max_explain 的图片 heatmap 为 None
+        """
+        if tensor.dim() == 3:
+            tensor = tensor.unsqueeze(0)
+        tensor = tensor.to(self.device)
+        wanted = [i for i, flag in enumerate(explain or []) if flag]
+        rows = wanted[:self.max_explain]
+
+        per_model = {}
+        heatmaps = {}
+        for name, model in self.models.items():
+            logits, features = self._forward(model, tensor, rows)
+            probs = torch.softmax(logits, dim=1)
+            topk_probs, topk_idxs = torch.topk(probs, k=self.topk, dim=1)
+            per_model[name] = (topk_probs.cpu().tolist(), topk_idxs.cpu().tolist())
+            if features is not None:
+                head = getattr(model, get_head_name(model))
+                cams = class_activation_map(head, features, topk_idxs[rows, 0]).cpu()
+                heatmaps[name] = dict(zip(rows, cams))
+
+        results = []
+        for i in range(tensor.size(0)):
+            image_results = []
+            for name, (topk_probs, topk_idxs) in per_model.items():
+                image_results.append({
+                    'model': name,
+                    'classes': [self.class_names[idx] for idx in topk_idxs[i]],
+                    'probs': topk_probs[i],
+                    'other_prob': max(1.0 - sum(topk_probs[i]), 0.0),
+                })
+                if i in wanted:
+                    image_results[-1]['heatmap'] = heatmaps.get(name, {}).get(i)
+            results.append(image_results)
+        return results
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(**kwargs):
+    """
+    获取进程内唯一的模型注册表，首次调用时加载模型
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(**kwargs)
+    return _registry
@@ -0,0 +1,58 @@
+# src/models/__init__.py
+
+import torch.nn as nn
+
+from .efficientnet_b0 import get_model as get_efficientnet_b0
+from .mobilenet_v3_large import get_model as get_mobilenet_v3_large
+from .resnet50 import get_model as get_resnet50
+
+MODEL_BUILDERS = {
+    'efficientnet_b0': get_efficientnet_b0,
+    'mobilenet_v3_large': get_mobilenet_v3_large,
+    'resnet50': get_resnet50,
+}
+
+
+def build_model(model_name, num_classes, pretrained=True):
+    """
+    按名称构建模型
+    """
+    if model_name not in MODEL_BUILDERS:
+        raise ValueError(f"未知的模型: {model_name}，可选: {', '.join(MODEL_BUILDERS)}")
+    return MODEL_BUILDERS[model_name](num_classes, pretrained=pretrained)
+
+
+def get_head_name(model):
+    """
+    返回分类层的属性名：ResNet 为 fc，EfficientNet / MobileNet 为 classifier
+    """
+    if isinstance(getattr(model, 'fc', None), nn.Module):
+        return 'fc'
+    if isinstance(getattr(model, 'classifier', None), nn.Module):
+        return 'classifier'
+    raise ValueError("未知的分类器结构")
+
+
+def get_last_conv_name(model):
+    """
+    返回最后一个卷积 block 的属性名：ResNet 为 layer4，EfficientNet / MobileNet 为 features
+
+    该 block 的输出经过全局平均池化后直接送入分类层
+    """
+    if isinstance(getattr(model, 'layer4', None), nn.Module):
+        return 'layer4'
+    if isinstance(getattr(model, 'features', None), nn.Module):
+        return 'features'
+    raise ValueError("未知的模型结构，无法找到最后一个卷积 block")
+
+
+def split_head(model):
+    """
+    取出分类层并在原模型中替换为 Identity，之后 model 输出池化后的特征向量
+
+    返回 (backbone, head)，backbone 与传入的 model 是同一个对象
+    """
+    head_name = get_head_name(model)
+    head = getattr(model, head_name)
+    setattr(model, head_name, nn.Identity())
+    return model, head
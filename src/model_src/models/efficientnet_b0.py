@@ -4,12 +4,15 @@ import torch.nn as nn
 from torchvision import models
 
 
-def get_model(num_classes):
+def get_model(num_classes, pretrained=True):
     """
     获取使用预训练权重的 EfficientNet-B0 模型，并修改全连接层以适应 100 个类别。
+
+    pretrained=False 时不加载 ImageNet 权重，用于随后直接加载微调权重的推理场景。
     """
     # 加载预训练的 EfficientNet-B0 模型
-    model = models.efficientnet_b0(weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1)
+    weights = models.EfficientNet_B0_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.efficientnet_b0(weights=weights)
 
     # 替换分类器
     in_features = model.classifier[1].in_features
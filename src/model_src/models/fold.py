@@ -0,0 +1,107 @@
+# src/models/fold.py
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def get_input_layers(model):
+    """
+    返回模型的第一个卷积层及其后的 BatchNorm 层
+    """
+    if hasattr(model, 'conv1') and hasattr(model, 'bn1'):
+        # ResNet
+        return model.conv1, model.bn1
+    if hasattr(model, 'features'):
+        # EfficientNet / MobileNetV3: features[0] 为 Conv2dNormActivation(conv, bn, act)
+        stem = model.features[0]
+        return stem[0], stem[1]
+    raise ValueError("未知的模型结构，无法找到第一个卷积层")
+
+
+def _border_correction(conv, input_mean, height, width):
+    """
+    计算输入零填充带来的边缘误差
+
+    原模型在归一化后的空间里补 0，相当于原始像素空间里补均值；折叠后在原始像素空间补 0，
+    差值只出现在输出的边缘几行/几列上，且与输入内容无关，可以按输入尺寸预先算好。
+    """
+    weight = conv.weight.detach()
+    input_mean = input_mean.to(weight).view(1, -1, 1, 1)
+    mean_image = input_mean.expand(1, weight.shape[1], height, width)
+    # 内部位置的响应等于卷积核对均值的完整响应，边缘位置缺少填充区域的部分
+    inside = F.conv2d(mean_image, weight, None, conv.stride, conv.padding, conv.dilation)[0]
+    full = (weight * input_mean).sum(dim=(1, 2, 3))
+    correction = full.view(-1, 1, 1) - inside
+
+    nonzero = correction.abs() > 1e-6 * full.abs().max()
+    rows = nonzero.any(dim=0).any(dim=1)
+    cols = nonzero.any(dim=0).any(dim=0)
+    top = int(rows.int().argmin()) if not rows.all() else len(rows)
+    bottom = int(rows.flip(0).int().argmin()) if not rows.all() else 0
+    left = int(cols.int().argmin()) if not cols.all() else len(cols)
+    right = int(cols.flip(0).int().argmin()) if not cols.all() else 0
+    return correction, (top, bottom, left, right)
+
+
+def _add_border_correction(output, correction, bands):
+    top, bottom, left, right = bands
+    out_h, out_w = output.shape[-2:]
+    # 只在边缘带上做加法，内部区域保持不变
+    if top:
+        output[..., :top, :] += correction[:, :top, :]
+    if bottom:
+        output[..., out_h - bottom:, :] += correction[:, out_h - bottom:, :]
+    middle = slice(top, out_h - bottom)
+    if left:
+        output[..., middle, :left] += correction[:, middle, :left]
+    if right:
+        output[..., middle, out_w - right:] += correction[:, middle, out_w - right:]
+    return output
+
+
+def fold_input_normalization(model, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), input_scale=1.0):
+    """
+    将输入的 Normalize 折叠进第一个卷积层，折叠后模型直接接收未归一化的输入
+
+    Args:
+        mean, std: 原先 transforms.Normalize 使用的参数
+        input_scale (float): 输入像素的上限，1.0 表示 [0, 1]，255 表示 [0, 255]
+
+    卷积权重按输入通道除以 input_scale * std；均值项 -sum(W * mean / std) 是常数，
+    吸收到后面 BatchNorm 的 running_mean 中。零填充造成的边缘差异用前向 hook 修正，
+    因此折叠后的输出与原模型一致。
+    """
+    conv, bn = get_input_layers(model)
+    if not isinstance(conv, nn.Conv2d) or not isinstance(bn, nn.BatchNorm2d) or conv.groups != 1:
+        raise ValueError("第一层必须是普通 Conv2d + BatchNorm2d 才能折叠归一化")
+    if getattr(model, 'input_normalization_folded', False):
+        return model
+
+    weight = conv.weight.detach()
+    mean = torch.tensor(mean, dtype=weight.dtype, device=weight.device)
+    std = torch.tensor(std, dtype=weight.dtype, device=weight.device)
+    with torch.no_grad():
+        shift = (weight * (mean / std).view(1, -1, 1, 1)).sum(dim=(1, 2, 3))
+        conv.weight.copy_(weight / (input_scale * std).view(1, -1, 1, 1))
+        if conv.bias is not None:
+            conv.bias.sub_(shift)
+        else:
+            bn.running_mean.add_(shift)
+
+    # 原始像素空间中的均值，用于计算边缘修正
+    raw_mean = mean * input_scale
+    cache = {}
+
+    def hook(module, inputs, output):
+        key = (inputs[0].shape[-2:], output.device, output.dtype)
+        if key not in cache:
+            with torch.no_grad():
+                correction, bands = _border_correction(module, raw_mean.to(output.device), *inputs[0].shape[-2:])
+            cache[key] = (correction.to(output.dtype), bands)
+        correction, bands = cache[key]
+        return _add_border_correction(output, correction, bands)
+
+    conv.register_forward_hook(hook)
+    model.input_normalization_folded = True
+    return model
@@ -4,12 +4,15 @@ import torch.nn as nn
 from torchvision import models
 
 
-def get_model(num_classes):
+def get_model(num_classes, pretrained=True):
     """
     获取使用预训练权重的 ResNet-50 模型，并修改全连接层以适应 100 个类别。
+
+    pretrained=False 时不加载 ImageNet 权重，用于随后直接加载微调权重的推理场景。
     """
     # 加载预训练的 ResNet-50 模型
-    model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
+    weights = models.ResNet50_Weights.IMAGENET1K_V2 if pretrained else None
+    model = models.resnet50(weights=weights)
 
     # 替换全连接层
     in_features = model.fc.in_features
@@ -0,0 +1,49 @@
+# src/models/weights.py
+
+import os
+import torch
+
+
+def find_checkpoint(checkpoint_dir, name='best_model'):
+    """
+    查找检查点文件，优先使用 safetensors 格式，其次是 .pth
+    """
+    for ext in ('.safetensors', '.pth'):
+        path = os.path.join(checkpoint_dir, name + ext)
+        if os.path.exists(path):
+            return path
+    return os.path.join(checkpoint_dir, name + '.pth')
+
+
+def read_state_dict(model_path, device='cpu'):
+    """
+    读取权重文件，.pth 使用内存映射方式加载，.safetensors 使用 safetensors 加载
+    """
+    if model_path.endswith('.safetensors'):
+        try:
+            from safetensors.torch import load_file
+        except ImportError:
+            raise ImportError("加载 .safetensors 权重需要安装 safetensors: pip install safetensors")
+        return load_file(model_path, device=str(device))
+
+    try:
+        # 内存映射只读取实际用到的页，且不会在内存中额外保留一份完整副本
+        return torch.load(model_path, map_location=device, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError):
+        # 旧版本 PyTorch 不支持 mmap，或检查点不是 zip 格式
+        return torch.load(model_path, map_location=device)
+
+
+def load_weights(model, model_path, device='cpu'):
+    """
+    将微调后的权重加载到模型中，并切换到推理模式
+    """
+    state_dict = read_state_dict(model_path, device)
+    try:
+        # assign=True 直接使用加载出的张量，避免再拷贝一次参数
+        model.load_state_dict(state_dict, assign=True)
+    except TypeError:
+        model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval()
+    return model
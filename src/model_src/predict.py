@@ -1,160 +1,42 @@
 # src/predict.py
 
 import os
-import torch
-import torch.nn as nn
-from torchvision import transforms
-from torch.utils.data import DataLoader, Dataset
-from PIL import Image
-import pandas as pd
+import argparse
+from torchvision.transforms.functional import pil_to_tensor
 from tqdm import tqdm
 
-from models.efficientnet_b0 import get_model as get_efficientnet_b0
-from models.mobilenet_v3_large import get_model as get_mobilenet_v3_large
-from models.resnet50 import get_model as get_resnet50
-
-
-class ResizeAndPad:
-    def __init__(self, size, fill=0):
-        """
-        Args:
-            size (tuple or int): Desired output size. If tuple, output size will be matched to this. If int, smaller edge will be matched to this.
-            fill (int or tuple): Pixel fill value for padding. Default: 0
-        """
-        if isinstance(size, int):
-            self.size = (size, size)
-        else:
-            self.size = size
-        self.fill = fill
-
-    def __call__(self, img):
-        # Get current and desired aspect ratios
-        original_size = img.size  # (width, height)
-        ratio = min(self.size[0] / original_size[0], self.size[1] / original_size[1])
-        new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
-        img = img.resize(new_size, Image.BICUBIC)
-
-        # Create a new image and paste the resized on it
-        new_img = Image.new("RGB", self.size, (self.fill, self.fill, self.fill))
-        paste_position = ((self.size[0] - new_size[0]) // 2,
-                          (self.size[1] - new_size[1]) // 2)
-        new_img.paste(img, paste_position)
-        return new_img
+from models.weights import load_weights
+from model_registry import PROJECT_ROOT, get_registry, result_to_row
+from prediction_writer import rows_to_csv, save_predictions
+# ResizeAndPad 保留在本模块中导出，兼容原先 from predict import ResizeAndPad 的用法
+from preprocessing import ResizeAndPad, open_image  # noqa: F401
 
 
 def load_model(model, model_path, device='cpu'):
     """
     加载模型权重
     """
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model = model.to(device)
-    model.eval()
-    return model
+    return load_weights(model, model_path, device)
 
 
 def predict_image(image_path):
     """预测单张图片"""
     try:
         print(f"开始处理图片: {image_path}")
-        
-        # 获取当前文件的绝对路径
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.abspath(os.path.join(current_dir, '../..'))
-        
+
         # 设置输出目录
-        output_dir = os.path.join(project_root, 'public/outputs/predictions')
-        os.makedirs(output_dir, exist_ok=True)
+        output_dir = os.path.join(PROJECT_ROOT, 'public/outputs/predictions')
         print(f"输出目录: {output_dir}")
-        
-        # 图像预处理
-        test_transforms = transforms.Compose([
-            ResizeAndPad((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406],
-                               [0.229, 0.224, 0.225])
-        ])
-        
+
+        # 模型只在首次调用时加载，之后常驻内存
+        registry = get_registry()
+
         print("加载图片...")
-        # 加载图像
-        image = Image.open(image_path).convert('RGB')
-        image = test_transforms(image).unsqueeze(0)  # 添加 batch 维度
-
-        # 加载类别名称
-        class_names_path = os.path.join(project_root, 'class_names.txt')
-        print(f"类别名称文件路径: {class_names_path}")
-        
-        with open(class_names_path, 'r') as f:
-            class_names = [line.strip() for line in f.readlines()]
-        
-        # 设置设备
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print(f"使用设备: {device}")
-        image = image.to(device)
-
-        # 模型路径
-        models_dir = os.path.join(project_root, 'experiments')
-        print(f"模型目录: {models_dir}")
-
-        # 加载三个模型
-        model1 = get_efficientnet_b0(len(class_names))
-        model1_path = os.path.join(project_root, 'experiments/efficientnet_b0/checkpoints/best_model.pth')
-        print(f"加载 EfficientNet 模型: {model1_path}")
-        model1 = load_model(model1, model1_path, device)
-
-        model2 = get_mobilenet_v3_large(len(class_names))
-        model2_path = os.path.join(project_root, 'experiments/mobilenet_v3_large/checkpoints/best_model.pth')
-        print(f"加载 MobileNet 模型: {model2_path}")
-        model2 = load_model(model2, model2_path, device)
-
-        model3 = get_resnet50(len(class_names))
-        model3_path = os.path.join(project_root, 'experiments/resnet50/checkpoints/best_model.pth')
-        print(f"加载 ResNet 模型: {model3_path}")
-        model3 = load_model(model3, model3_path, device)
-
-        # Softmax
-        softmax = nn.Softmax(dim=1)
+        image = registry.load_image(image_path)
 
         # 预测
-        results = []
-        for model_name, model in [('efficientnet', model1), 
-                              ('mobilenet', model2), 
-                              ('resnet', model3)]:
-            outputs = model(image)
-            probs = softmax(outputs)
-            top3_probs, top3_idxs = torch.topk(probs, k=3, dim=1)
-            
-            # 获取预测结果
-            top3_prob = top3_probs[0].cpu().detach().numpy()
-            top3_idx = top3_idxs[0].cpu().detach().numpy()
-            top3_classes = [class_names[idx] for idx in top3_idx]
-            
-            # 计算其他类别的概率
-            other_prob = 1.0 - top3_prob.sum()
-            other_prob = max(other_prob, 0.0)
-            
-            # 保存结果
-            results.append([
-                model_name,
-                top3_classes[0], round(float(top3_prob[0]), 2),
-                top3_classes[1], round(float(top3_prob[1]), 2),
-                top3_classes[2], round(float(top3_prob[2]), 2),
-                round(float(other_prob), 2)
-            ])
-            
-            # 为每个模型保存单独的预测结果
-            model_results = pd.DataFrame([[
-                top3_classes[0], round(float(top3_prob[0]), 2),
-                top3_classes[1], round(float(top3_prob[1]), 2),
-                top3_classes[2], round(float(top3_prob[2]), 2),
-                round(float(other_prob), 2)
-            ]])
-            model_csv_path = os.path.join(output_dir, f'{model_name}_predictions.csv')
-            model_results.to_csv(model_csv_path, index=False, header=False)
-
-        # 保存总体结果
-        df = pd.DataFrame(results)
-        csv_path = os.path.join(output_dir, 'predictions.csv')
-        df.to_csv(csv_path, index=False, header=False)
+        results = registry.predict(image)[0]
+        save_predictions(results, output_dir)
         return True
 
     except Exception as e:
@@ -164,5 +46,44 @@ def predict_image(image_path):
         return False
 
 
+def predict_images(image_paths, batch_size=16):
+    """批量预测多张图片，返回每张图片在各模型上的结果"""
+    registry = get_registry()
+    results = []
+    for start in tqdm(range(0, len(image_paths), batch_size), desc='预测中'):
+        batch_paths = image_paths[start:start + batch_size]
+        images = [pil_to_tensor(open_image(path, registry.image_size)) for path in batch_paths]
+        results.extend(registry.predict(registry.preprocess_batch(images)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量预测图片")
+    parser.add_argument('images', nargs='*', help='图片路径或目录，默认使用 src/input')
+    parser.add_argument('--batch-size', type=int, default=16, help='批次大小')
+    parser.add_argument('--output', help='保存预测结果的 CSV 路径')
+    args = parser.parse_args()
+
+    image_paths = []
+    for path in args.images or [os.path.join(PROJECT_ROOT, 'src/input')]:
+        if os.path.isdir(path):
+            image_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            image_paths.append(path)
+
+    results = predict_images(image_paths, args.batch_size)
+
+    # 每行: 图片名, 模型名, 类别1, 概率1, ..., 其他类别概率
+    rows = [[os.path.basename(path)] + result_to_row(result)
+            for path, image_results in zip(image_paths, results)
+            for result in image_results]
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            f.write(rows_to_csv(rows))
+        print(f"预测结果已保存到 {args.output}")
+    else:
+        print(rows_to_csv(rows), end='')
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+# src/prediction_writer.py
+
+import csv
+import io
+import os
+import queue
+import threading
+
+from model_registry import result_to_row
+
+
+def rows_to_csv(rows):
+    """
+    将预测结果行格式化为 CSV 文本
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+def _write_text(path, text):
+    # 先写临时文件再替换，读取方不会看到写了一半的文件
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def save_predictions(results, output_dir):
+    """
+    将单张图片的预测结果保存为 predictions.csv 及每个模型单独的 CSV
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows = [result_to_row(result) for result in results]
+    for row in rows:
+        # 为每个模型保存单独的预测结果
+        _write_text(os.path.join(output_dir, f'{row[0]}_predictions.csv'), rows_to_csv([row[1:]]))
+
+    # 保存总体结果
+    _write_text(os.path.join(output_dir, 'predictions.csv'), rows_to_csv(rows))
+    return rows
+
+
+class PredictionWriter:
+    """
+    在后台线程中保存预测结果 CSV，不阻塞请求处理；队列满时丢弃最新结果
+    """
+
+    def __init__(self, output_dir, max_pending=32):
+        self.output_dir = output_dir
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+        self.worker.start()
+
+    def submit(self, results):
+        try:
+            self.queue.put_nowait(results)
+        except queue.Full:
+            print("预测结果写入队列已满，跳过本次保存")
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def _run(self):
+        while True:
+            results = self.queue.get()
+            if results is None:
+                break
+            try:
+                save_predictions(results, self.output_dir)
+            except Exception as e:
+                print(f"保存预测结果失败: {str(e)}")
@@ -0,0 +1,147 @@
+# src/preprocessing.py
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torchvision import transforms
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class ResizeAndPad:
+    def __init__(self, size, fill=0):
+        """
+        Args:
+            size (tuple or int): Desired output size. If tuple, output size will be matched to this. If int, smaller edge will be matched to this.
+            fill (int or tuple): Pixel fill value for padding. Default: 0
+        """
+        if isinstance(size, int):
+            self.size = (size, size)
+        else:
+            self.size = size
+        self.fill = fill
+
+    def __call__(self, img):
+        # Get current and desired aspect ratios
+        original_size = img.size  # (width, height)
+        ratio = min(self.size[0] / original_size[0], self.size[1] / original_size[1])
+        new_size = (int(original_size[0] * ratio), int(original_size[1] * ratio))
+        img = img.resize(new_size, Image.BICUBIC)
+
+        # Create a new image and paste the resized on it
+        new_img = Image.new("RGB", self.size, (self.fill, self.fill, self.fill))
+        paste_position = ((self.size[0] - new_size[0]) // 2,
+                          (self.size[1] - new_size[1]) // 2)
+        new_img.paste(img, paste_position)
+        return new_img
+
+
+class TensorResizeAndPad:
+    """
+    ResizeAndPad 的张量版本，可一次处理整个批次，并在最后融合 ToTensor 的缩放与 Normalize
+
+    输入为 uint8 的 (C, H, W)、(N, C, H, W) 或尺寸不同的 (C, H, W) 列表，
+    输出为 float32 的 (N, C, size[1], size[0])。
+    """
+
+    def __init__(self, size, fill=0, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        """
+        Args:
+            size (tuple or int): 输出尺寸 (width, height)，与 ResizeAndPad 一致
+            fill (int): 填充像素值 (0-255)
+            mean, std: 归一化参数，mean 为 None 时只缩放到 [0, 1]（用于已折叠归一化的模型）
+        """
+        if isinstance(size, int):
+            self.size = (size, size)
+        else:
+            self.size = size
+        self.fill = fill
+        self.normalize = mean is not None
+        mean = torch.tensor(mean if self.normalize else [0.0, 0.0, 0.0]).view(3, 1, 1)
+        std = torch.tensor(std if self.normalize else [1.0, 1.0, 1.0]).view(3, 1, 1)
+        # 归一化写成 x * scale - shift，x 为 0-255 的像素值
+        self.scale = 1.0 / (255.0 * std)
+        self.shift = mean / std
+
+    def _resize(self, images, new_size):
+        # 与 PIL 的 BICUBIC 一致：antialias=True 使用与 PIL 相同的卷积核（a=-0.5，缩小时按比例放宽），
+        # 并且与 PIL 一样先横向、后纵向两次缩放，每次都舍入并截断到 uint8 的像素范围。
+        # 放大时插值会超出 [0, 255]，不在中间截断会与 PIL 相差几十个像素值
+        new_height, new_width = new_size
+        # 之后会原地归一化，尺寸不变时也不能修改调用方的张量
+        images = images.to(torch.float32, copy=True)
+        if images.shape[-1] != new_width:
+            images = F.interpolate(images, size=(images.shape[-2], new_width), mode='bicubic',
+                                   align_corners=False, antialias=True).round_().clamp_(0, 255)
+        if images.shape[-2] != new_height:
+            images = F.interpolate(images, size=(new_height, new_width), mode='bicubic',
+                                   align_corners=False, antialias=True).round_().clamp_(0, 255)
+        return images
+
+    def __call__(self, images):
+        if isinstance(images, torch.Tensor) and images.dim() == 3:
+            images = images.unsqueeze(0)
+
+        width, height = self.size
+        num_images = len(images)
+        channels = images[0].shape[-3]
+        out = torch.empty((num_images, channels, height, width), dtype=torch.float32)
+        out.copy_((self.fill * self.scale - self.shift).expand_as(out[0]))
+
+        if isinstance(images, torch.Tensor):
+            # 同尺寸的批次只需一次插值
+            groups = [(slice(0, num_images), images)]
+        else:
+            groups = [(slice(i, i + 1), image.unsqueeze(0)) for i, image in enumerate(images)]
+
+        for index, batch in groups:
+            src_height, src_width = batch.shape[-2:]
+            ratio = min(width / src_width, height / src_height)
+            new_width, new_height = int(src_width * ratio), int(src_height * ratio)
+            top = (height - new_height) // 2
+            left = (width - new_width) // 2
+            resized = self._resize(batch, (new_height, new_width)).mul_(self.scale)
+            if self.normalize:
+                # 融合的归一化，直接写入画布对应位置
+                resized.sub_(self.shift)
+            out[index, :, top:top + new_height, left:left + new_width] = resized
+        return out
+
+
+def open_image(fp, size=(224, 224), reducing_gap=2.0):
+    """
+    以接近目标尺寸的较低分辨率解码图片，返回 RGB 图像
+
+    JPEG 使用 draft() 在解码阶段按 1/2、1/4、1/8 的 DCT 缩放直接输出小图；
+    其他格式完整解码后先用 reduce() 做整数倍缩小，减少后续 BICUBIC 缩放的计算量。
+    与 Image.thumbnail 相同，保留至少 reducing_gap 倍于最终尺寸的分辨率，
+    最终大小仍由 ResizeAndPad 决定。
+    """
+    if isinstance(size, int):
+        size = (size, size)
+
+    with Image.open(fp) as image:
+        # 与 ResizeAndPad 相同的缩放比例，计算最终需要的尺寸
+        ratio = min(size[0] / image.size[0], size[1] / image.size[1])
+        needed = (max(1, int(image.size[0] * ratio)), max(1, int(image.size[1] * ratio)))
+        if image.format == 'JPEG':
+            image.draft('RGB', (int(needed[0] * reducing_gap), int(needed[1] * reducing_gap)))
+        image = image.convert('RGB')
+
+    factor = int(min(image.size[0] / needed[0], image.size[1] / needed[1]) / reducing_gap)
+    if factor > 1:
+        image = image.reduce(factor)
+    return image
+
+
+def build_test_transforms(size=(224, 224), normalize=True):
+    """
+    推理阶段的图像预处理
+
+    normalize=False 时不做 Normalize，用于已将归一化折叠进第一层卷积的模型
+    """
+    steps = [ResizeAndPad(size), transforms.ToTensor()]
+    if normalize:
+        steps.append(transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD))
+    return transforms.Compose(steps)
@@ -1,14 +1,73 @@
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import json
 import os
 import base64
-from predict import predict_image
+import binascii
+import argparse
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, urlsplit
+from PIL import UnidentifiedImageError
+from batching import MicroBatcher, QueueFullError
+from model_registry import encode_heatmap, get_registry, result_to_row
+from prediction_writer import PredictionWriter, rows_to_csv
+
+# 可直接作为请求体上传的图片类型
+IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+
+class RequestError(Exception):
+    """
+    请求本身有问题，以指定的 HTTP 状态码返回给客户端
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_multipart_image(content_type, body):
+    """
+    从 multipart/form-data 请求体中取出图片字段（优先 image 字段，其次第一个文件）
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    fallback = None
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'image':
+            return part.get_payload(decode=True)
+        if fallback is None and part.get_filename():
+            fallback = part.get_payload(decode=True)
+    if fallback is None:
+        raise RequestError(400, '表单中没有图片字段')
+    return fallback
+
+
+def explanations_from_results(results):
+    """
+    每个模型 top-1 类别的热力图；超出每批解释数量上限的图片没有热力图
+    """
+    explanations = []
+    for result in results:
+        explanation = {'model': result['model'], 'class': result['classes'][0]}
+        if result.get('heatmap') is None:
+            explanation['error'] = '服务器繁忙，本次未生成热力图'
+        else:
+            height, width = result['heatmap'].shape
+            explanation.update(width=width, height=height, heatmap=encode_heatmap(result['heatmap']))
+        explanations.append(explanation)
+    return explanations
+
 
 class CORSRequestHandler(SimpleHTTPRequestHandler):
+    registry = None
+    batcher = None
+    prediction_writer = None
+    max_body_size = 20 * 1024 * 1024
+
     def __init__(self, *args, **kwargs):
         self.current_dir = os.path.dirname(os.path.abspath(__file__))
         self.project_root = os.path.abspath(os.path.join(self.current_dir, '../..'))
-        self.is_processing = False
         super().__init__(*args, **kwargs)
 
     def end_headers(self):
@@ -24,68 +83,111 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.end_headers()
 
+    def send_json_error(self, status, message):
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(json.dumps({'error': message}).encode())
+
+    def read_image_bytes(self):
+        """
+        读取请求中的图片数据，支持三种格式：
+        base64 JSON（{"image": "data:...;base64,..."}）、图片二进制请求体、multipart/form-data
+        """
+        if self.headers['Content-Length'] is None:
+            raise RequestError(411, '缺少 Content-Length')
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except ValueError:
+            raise RequestError(400, 'Content-Length 不是整数')
+        # 负数会让 rfile.read 一直读到连接关闭
+        if content_length < 0:
+            raise RequestError(400, 'Content-Length 不能为负数')
+        # 在读取请求体之前检查大小
+        if content_length > self.max_body_size:
+            raise RequestError(413, f'请求体过大，最大允许 {self.max_body_size} 字节')
+
+        content_type = self.headers.get('Content-Type', 'application/json')
+        mime_type = content_type.split(';')[0].strip().lower()
+        post_data = self.rfile.read(content_length)
+
+        if mime_type in IMAGE_CONTENT_TYPES:
+            return post_data
+        if mime_type == 'multipart/form-data':
+            return parse_multipart_image(content_type, post_data)
+
+        try:
+            data = json.loads(post_data.decode('utf-8'))
+            # 兼容带 data:...;base64, 前缀和不带前缀的 base64
+            return base64.b64decode(data['image'].split(',')[-1], validate=True)
+        except (ValueError, binascii.Error, KeyError, TypeError, AttributeError):
+            raise RequestError(400, '请求体不是包含 base64 图片字段 image 的 JSON')
+
+    def decode_image(self, img_data):
+        """
+        解码并预处理图片，无法识别的图片数据返回 415
+        """
+        try:
+            return self.registry.decode(img_data)
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            raise RequestError(415, f'无法解码图片: {e}')
+
     def do_POST(self):
-        if self.path == '/predict':
+        url = urlsplit(self.path)
+        if url.path == '/predict':
+            # /predict?explain=1 时额外返回每个模型 top-1 类别的热力图（JSON）
+            explain = parse_qs(url.query).get('explain', ['0'])[0].lower() in ('1', 'true')
             try:
-                print(f"收到预测请求，当前处理状态: {self.is_processing}")
-                if self.is_processing:
-                    print("已有请求正在处理，拒绝新请求")
-                    self.send_response(429)
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
-                        'error': '正在处理上一个请求，请稍后再试'
-                    }).encode())
+                print("开始处理预测请求...")
+
+                try:
+                    img_data = self.read_image_bytes()
+                    print("解码图片数据...")
+                    image_tensor = self.decode_image(img_data)
+                except RequestError as e:
+                    print(f"请求无效: {str(e)}")
+                    self.send_json_error(e.status, str(e))
                     return
 
-                self.is_processing = True
-                print("开始处理预测请求...")
-                
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                print("解码图片数据...")
-                img_data = base64.b64decode(data['image'].split(',')[1])
-                
-                temp_path = os.path.join(self.current_dir, 'temp_image.jpg')
-                print(f"保存临时文件到: {temp_path}")
-                
-                with open(temp_path, 'wb') as f:
-                    f.write(img_data)
-                
                 print("开始执行预测...")
-                success = predict_image(temp_path)
-                
-                print(f"预测结果: {'成功' if success else '失败'}")
-                
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                
-                if success:
-                    result_path = os.path.join(self.project_root, 'public/outputs/predictions/predictions.csv')
-                    print(f"读取预测结果: {result_path}")
-                    
-                    with open(result_path, 'r') as f:
-                        predictions = f.read()
-                    
-                    response_data = predictions.encode()
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain')
-                    self.send_header('Content-Length', str(len(response_data)))
-                    self.end_headers()
-                    
-                    print("发送预测结果...")
-                    try:
-                        self.wfile.write(response_data)
-                        self.wfile.flush()
-                        print("预测结果发送完成")
-                    except (BrokenPipeError, ConnectionResetError) as e:
-                        print(f"发送数据时连接断开: {str(e)}")
-                        return
+                # 与其他并发请求合并成一个批次执行，队列已满时直接拒绝
+                try:
+                    results = self.batcher.predict(image_tensor, explain=explain)
+                except QueueFullError:
+                    print("等待队列已满，拒绝新请求")
+                    self.send_json_error(429, '服务器繁忙，请稍后再试')
+                    return
+
+                print("预测结果: 成功")
+                if self.prediction_writer is not None:
+                    # CSV 在后台线程写入，不影响响应时间
+                    self.prediction_writer.submit(results)
+
+                rows = [result_to_row(result) for result in results]
+                if explain:
+                    # PNG 编码在请求线程中进行，不占用模型执行线程
+                    response_data = json.dumps({
+                        'predictions': rows_to_csv(rows),
+                        'explanations': explanations_from_results(results),
+                    }, ensure_ascii=False).encode()
+                    content_type = 'application/json'
                 else:
-                    raise Exception("预测失败")
-                    
+                    response_data = rows_to_csv(rows).encode()
+                    content_type = 'text/plain'
+
+                self.send_response(200)
+                self.send_header('Content-type', content_type)
+                self.send_header('Content-Length', str(len(response_data)))
+                self.end_headers()
+
+                print("发送预测结果...")
+                try:
+                    self.wfile.write(response_data)
+                    self.wfile.flush()
+                    print("预测结果发送完成")
+                except (BrokenPipeError, ConnectionResetError) as e:
+                    print(f"发送数据时连接断开: {str(e)}")
+                    return
+
             except Exception as e:
                 print(f"错误详情: {str(e)}")
                 print(f"错误类型: {type(e)}")
@@ -104,8 +206,6 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
                     self.wfile.flush()
                 except:
                     pass
-                print("重置处理状态...")
-                self.is_processing = False
                 print("请求处理完成")
         else:
             self.send_response(404)
@@ -115,14 +215,62 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
         """重写错误处理方法，避免在连接断开时打印堆栈跟踪"""
         print(f"处理请求时发生错误: {client_address}")
 
-def run_server(port=8000):
+class PredictionServer(ThreadingHTTPServer):
+    """
+    每个连接一个守护线程；监听队列长度 request_queue_size 默认只有 5，
+    并发连接多时内核会直接重置连接，客户端收不到有界队列满时的 429，因此按 listen_backlog 设置
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, listen_backlog=128):
+        # 必须在父类 __init__ 调用 listen() 之前设置
+        self.request_queue_size = listen_backlog
+        super().__init__(server_address, handler_class)
+
+
+def run_server(port=8000, max_batch_size=16, max_wait_ms=5, max_queue_size=64, save_predictions=False,
+               max_body_mb=20, max_explain=4, listen_backlog=None):
+    CORSRequestHandler.max_body_size = int(max_body_mb * 1024 * 1024)
+    # 启动时一次性加载全部模型，之后每个请求直接复用
+    CORSRequestHandler.registry = get_registry(max_explain=max_explain)
+    CORSRequestHandler.batcher = MicroBatcher(CORSRequestHandler.registry.predict,
+                                              max_batch_size=max_batch_size,
+                                              max_wait_ms=max_wait_ms,
+                                              max_queue_size=max_queue_size)
+    if save_predictions:
+        output_dir = os.path.join(CORSRequestHandler.registry.project_root, 'public/outputs/predictions')
+        CORSRequestHandler.prediction_writer = PredictionWriter(output_dir)
     server_address = ('127.0.0.1', port)
-    httpd = HTTPServer(server_address, CORSRequestHandler)
+    # 每个连接一个线程：网络读写、解码和预处理并发进行，模型执行统一经过有界队列
+    # 监听队列默认与有界队列一样长，排队的连接都能被接受并得到 200 或 429
+    httpd = PredictionServer(server_address, CORSRequestHandler,
+                             listen_backlog=listen_backlog or max_queue_size)
     print(f'Starting server on http://127.0.0.1:{port}')
     httpd.serve_forever()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Butterfly Classification Server")
+    parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='微批处理的最大批次大小')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='微批处理凑批次的最长等待时间（毫秒）')
+    parser.add_argument('--max-queue-size', type=int, default=64, help='等待执行的图片数上限，超出时返回 429')
+    parser.add_argument('--save-predictions', action='store_true',
+                        help='在后台将预测结果保存到 public/outputs/predictions')
+    parser.add_argument('--max-body-mb', type=float, default=20, help='请求体大小上限（MB），超出时返回 413')
+    parser.add_argument('--max-explain', type=int, default=4,
+                        help='每个批次最多为多少张图片生成热力图（/predict?explain=1），超出的只返回预测结果')
+    parser.add_argument('--listen-backlog', type=int, default=None,
+                        help='TCP 监听队列长度，默认与 --max-queue-size 相同')
+    args = parser.parse_args()
+
     try:
-        run_server()
+        run_server(port=args.port,
+                   max_batch_size=args.max_batch_size,
+                   max_wait_ms=args.max_wait_ms,
+                   max_queue_size=args.max_queue_size,
+                   save_predictions=args.save_predictions,
+                   max_body_mb=args.max_body_mb,
+                   max_explain=args.max_explain,
+                   listen_backlog=args.listen_backlog)
     except Exception as e:
         print(f"服务器启动失败: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,7 @@
+# src/tests/conftest.py
+
+import os
+import sys
+
+# 与直接运行 src 下的脚本相同，使 preprocessing、models 等模块可以直接导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
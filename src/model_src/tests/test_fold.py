@@ -0,0 +1,79 @@
+# src/tests/test_fold.py
+
+import copy
+
+import pytest
+import torch
+from torchvision.transforms.functional import normalize
+
+from models import MODEL_BUILDERS, build_model
+from models.fold import fold_input_normalization, get_input_layers
+from preprocessing import IMAGENET_MEAN, IMAGENET_STD
+
+NUM_CLASSES = 5
+# ResNet-50 随机初始化时 logits 可达几十，float32 累加误差约 3e-5
+ATOL = 1e-4
+
+
+@pytest.fixture(scope='module', params=list(MODEL_BUILDERS))
+def models(request):
+    """
+    (原模型, 折叠后的模型)；不需要 ImageNet 预训练权重
+    """
+    torch.manual_seed(0)
+    model = build_model(request.param, NUM_CLASSES, pretrained=False).eval()
+    folded = fold_input_normalization(copy.deepcopy(model), IMAGENET_MEAN, IMAGENET_STD)
+    return model, folded
+
+
+def run(model, inputs):
+    """
+    返回 (logits, 第一个 BatchNorm 的输出)
+
+    随机初始化的 EfficientNet / MobileNet 的 logits 几乎不随输入变化，
+    同时比较第一层的输出，边缘修正或第一层查找出错时也能发现
+    """
+    stem = {}
+    _, bn = get_input_layers(model)
+    handle = bn.register_forward_hook(lambda module, args, output: stem.setdefault('output', output.clone()))
+    try:
+        with torch.no_grad():
+            logits = model(inputs)
+    finally:
+        handle.remove()
+    return logits, stem['output']
+
+
+@pytest.mark.parametrize('height, width', [
+    (224, 224),
+    (200, 280),   # 非正方形，边缘修正按输入尺寸重新计算
+])
+def test_folded_matches_normalized_input(models, height, width):
+    model, folded = models
+    images = torch.rand(2, 3, height, width, generator=torch.Generator().manual_seed(height))
+
+    logits, stem = run(model, normalize(images, IMAGENET_MEAN, IMAGENET_STD))
+    folded_logits, folded_stem = run(folded, images)
+
+    # 包括零填充影响的边缘行列
+    torch.testing.assert_close(folded_stem, stem, rtol=0, atol=ATOL)
+    torch.testing.assert_close(folded_logits, logits, rtol=1e-5, atol=ATOL)
+
+
+def test_input_scale_255(models):
+    model, _ = models
+    folded = fold_input_normalization(copy.deepcopy(model), IMAGENET_MEAN, IMAGENET_STD, input_scale=255)
+    images = torch.rand(1, 3, 224, 224, generator=torch.Generator().manual_seed(1))
+
+    logits, stem = run(model, normalize(images, IMAGENET_MEAN, IMAGENET_STD))
+    folded_logits, folded_stem = run(folded, images * 255)
+
+    torch.testing.assert_close(folded_stem, stem, rtol=0, atol=ATOL)
+    torch.testing.assert_close(folded_logits, logits, rtol=1e-5, atol=ATOL)
+
+
+def test_fold_is_idempotent(models):
+    _, folded = models
+    weight = get_input_layers(folded)[0].weight.clone()
+    assert fold_input_normalization(folded, IMAGENET_MEAN, IMAGENET_STD) is folded
+    assert torch.equal(get_input_layers(folded)[0].weight, weight)
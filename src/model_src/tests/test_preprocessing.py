@@ -0,0 +1,73 @@
+# src/tests/test_preprocessing.py
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision.transforms.functional import pil_to_tensor
+
+from preprocessing import IMAGENET_STD, TensorResizeAndPad, build_test_transforms
+
+SIZE = (224, 224)
+# PIL 用定点数计算，横向、纵向两次缩放各自可能相差 1 个像素值（0-255），合计最多 2 个，
+# 换算到归一化后的单位约为 0.035
+ATOL = 2.0 / (255 * min(IMAGENET_STD)) + 1e-5
+
+
+def random_image(width, height, seed=0):
+    """
+    随机噪声图像：插值的过冲最明显，是最严格的比较
+    """
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def pil_reference(image, normalize=True):
+    return build_test_transforms(SIZE, normalize=normalize)(image)
+
+
+@pytest.mark.parametrize('width, height', [
+    (640, 480),   # 缩小
+    (100, 80),    # 放大
+    (30, 30),     # 大幅放大
+    (50, 120),    # 竖向非正方形
+    (500, 170),   # 横向非正方形
+    (224, 224),   # 尺寸不变
+])
+def test_matches_pil_single_image(width, height):
+    image = random_image(width, height)
+    output = TensorResizeAndPad(SIZE)(pil_to_tensor(image))
+    assert output.shape == (1, 3, SIZE[1], SIZE[0])
+    reference = pil_reference(image)
+    torch.testing.assert_close(output[0], reference, atol=ATOL, rtol=0)
+    # 绝大多数像素完全一致
+    assert (output[0] - reference).abs().mean() < 1e-3
+
+
+def test_matches_pil_without_normalize():
+    image = random_image(90, 140)
+    output = TensorResizeAndPad(SIZE, mean=None, std=None)(pil_to_tensor(image))
+    torch.testing.assert_close(output[0], pil_reference(image, normalize=False), atol=2 / 255 + 1e-6, rtol=0)
+
+
+def test_matches_pil_list_of_sizes():
+    images = [random_image(w, h, seed=i) for i, (w, h) in enumerate([(640, 480), (60, 90), (300, 120)])]
+    output = TensorResizeAndPad(SIZE)([pil_to_tensor(image) for image in images])
+    assert output.shape == (3, 3, SIZE[1], SIZE[0])
+    for i, image in enumerate(images):
+        torch.testing.assert_close(output[i], pil_reference(image), atol=ATOL, rtol=0)
+
+
+def test_matches_pil_batch():
+    images = [random_image(120, 90, seed=i) for i in range(4)]
+    batch = torch.stack([pil_to_tensor(image) for image in images])
+    output = TensorResizeAndPad(SIZE)(batch)
+    for i, image in enumerate(images):
+        torch.testing.assert_close(output[i], pil_reference(image), atol=ATOL, rtol=0)
+
+
+def test_does_not_modify_input():
+    batch = torch.randint(0, 256, (2, 3, 224, 224), dtype=torch.uint8).float()
+    original = batch.clone()
+    TensorResizeAndPad(SIZE)(batch)
+    assert torch.equal(batch, original)
@@ -0,0 +1,148 @@
+# src/training/checkpoint.py
+
+import contextlib
+import glob
+import os
+import queue
+import random
+import re
+import threading
+
+import numpy as np
+import torch
+
+STATE_PATTERN = 'state_epoch_{:04d}.pth'
+BEST_NAME = 'best_model.pth'
+
+
+def snapshot(obj):
+    """
+    递归复制 state_dict 等嵌套结构中的张量到 CPU，之后训练继续更新参数也不影响快照
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return obj
+
+
+def get_rng_state():
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        'numpy': np.random.get_state(),
+        'python': random.getstate(),
+    }
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+
+@contextlib.contextmanager
+def use_rng_state(state):
+    """
+    在 with 块内使用 state 中的随机数状态（torch、cuda、numpy、python），
+    结束时把推进后的状态写回 state，并恢复进入前的全局状态
+
+    Dropout 等只能从全局随机数生成器取数，用这种方式让每个模型拥有独立的随机数序列
+    """
+    outer = get_rng_state()
+    set_rng_state(state)
+    try:
+        yield state
+    finally:
+        state.update(get_rng_state())
+        set_rng_state(outer)
+
+
+def atomic_save(obj, path):
+    # 先写临时文件再替换，进程在写入中途被杀掉也不会留下损坏的检查点
+    tmp_path = f'{path}.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    """
+    在后台线程中保存检查点：每个 epoch 保存一份完整训练状态，只保留最近 keep_last 份；
+    最佳模型的权重另存为 best_model.pth，格式与 predict.load_model 读取的相同
+
+    save / save_best 在调用线程中只把张量复制到 CPU，序列化和写盘在后台完成。
+    队列满时 save 会等待，保证检查点不会被丢弃
+    """
+
+    def __init__(self, checkpoint_dir, keep_last=3, max_pending=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self.worker.start()
+
+    @property
+    def best_path(self):
+        return os.path.join(self.checkpoint_dir, BEST_NAME)
+
+    def save(self, state, epoch):
+        """
+        保存 epoch 结束时的完整训练状态（模型、优化器、调度器、早停计数、随机数状态等），
+        文件名中的 epoch 从 1 开始计数，与训练日志一致
+        """
+        path = os.path.join(self.checkpoint_dir, STATE_PATTERN.format(epoch))
+        self.queue.put((snapshot(state), path, True))
+
+    def save_best(self, model_state):
+        self.queue.put((snapshot(model_state), self.best_path, False))
+
+    def state_paths(self):
+        """
+        按 epoch 从小到大返回已保存的完整状态文件
+        """
+        paths = glob.glob(os.path.join(self.checkpoint_dir, 'state_epoch_*.pth'))
+        return sorted(paths, key=lambda path: int(re.search(r'(\d+)\.pth$', path).group(1)))
+
+    def load_latest(self, map_location='cpu'):
+        """
+        读取最近一次保存的完整训练状态，没有时返回 None
+        """
+        paths = self.state_paths()
+        if not paths:
+            return None
+        print(f"从检查点恢复训练: {paths[-1]}")
+        return torch.load(paths[-1], map_location=map_location, weights_only=False)
+
+    def wait(self):
+        """
+        等待已提交的检查点全部写完
+        """
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+    def _prune(self):
+        for path in self.state_paths()[:-self.keep_last]:
+            os.remove(path)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                obj, path, is_state = item
+                atomic_save(obj, path)
+                if is_state:
+                    self._prune()
+            except Exception as e:
+                print(f"保存检查点失败: {str(e)}")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,85 @@
+# src/training/distributed.py
+
+import os
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from src.training.engine import build_arg_parser, configs_from_args, print_throughput_summary, run_training
+
+
+def default_num_threads(local_world_size):
+    """
+    同一台机器上的多个进程平分 CPU 核，避免线程数超额导致互相抢占
+    """
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_cpus = os.cpu_count() or 1
+    return max(1, num_cpus // local_world_size)
+
+
+def run_worker(configs):
+    """
+    在已初始化的进程组中训练；返回值只在 rank 0 上打印
+    """
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    for config in configs:
+        if not config['num_threads']:
+            config['num_threads'] = default_num_threads(local_world_size)
+
+    trained = run_training(configs)
+    if dist.get_rank() == 0:
+        print_throughput_summary({model_name: metrics for model_name, (_, metrics) in trained.items()})
+
+
+def _spawn_entry(local_rank, nproc, master_addr, master_port, configs):
+    os.environ.update({
+        'MASTER_ADDR': master_addr,
+        'MASTER_PORT': str(master_port),
+        'RANK': str(local_rank),
+        'LOCAL_RANK': str(local_rank),
+        'WORLD_SIZE': str(nproc),
+        'LOCAL_WORLD_SIZE': str(nproc),
+    })
+    dist.init_process_group('gloo', rank=local_rank, world_size=nproc)
+    try:
+        run_worker(configs)
+    finally:
+        dist.destroy_process_group()
+
+
+def main(argv=None):
+    """
+    多进程数据并行训练（gloo 后端，CPU）
+
+    单机: python -m src.training.distributed --nproc-per-node 4 --model resnet50 ...
+    多机: 在每台机器上用 torchrun --nnodes N --nproc-per-node M -m src.training.distributed --model ... 启动，
+    进程组信息从 torchrun 设置的环境变量读取。多机时各机器需要能访问同一个实验目录才能恢复训练
+    """
+    parser = build_arg_parser(description="多进程数据并行训练分类层（gloo 后端）")
+    parser.add_argument('--nproc-per-node', type=int, default=2, help='本机启动的训练进程数（torchrun 启动时忽略）')
+    parser.add_argument('--master-addr', default='127.0.0.1')
+    parser.add_argument('--master-port', type=int, default=29500)
+    args = parser.parse_args(argv)
+    if not args.single_pass and len(args.model) > 1:
+        parser.error('多进程训练多个模型时需要同时指定 --single-pass')
+    try:
+        configs = configs_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if 'RANK' in os.environ:
+        # 由 torchrun 启动，进程组参数已在环境变量中
+        dist.init_process_group('gloo')
+        try:
+            run_worker(configs)
+        finally:
+            dist.destroy_process_group()
+        return
+
+    mp.spawn(_spawn_entry, args=(args.nproc_per_node, args.master_addr, args.master_port, configs),
+             nprocs=args.nproc_per_node)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,551 @@
+# src/training/engine.py
+
+import argparse
+import contextlib
+import json
+import os
+import time
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.optim as optim
+from tqdm import tqdm
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.tensorboard import SummaryWriter
+
+from src.models import MODEL_BUILDERS, build_model, get_head_name
+from src.training.checkpoint import CheckpointManager, get_rng_state, set_rng_state, use_rng_state
+from src.utils.data_loader import DEFAULT_LOADER_CONFIG, get_data_loaders, load_loader_config
+from src.utils.loader_stats import LoaderStallMonitor
+from src.utils.metrics import MetricAccumulator
+from src.utils.visualization import save_metrics_to_csv
+
+# 训练配置的默认值；数据加载相关的键（batch_size、num_workers 等）见 DEFAULT_LOADER_CONFIG
+DEFAULT_TRAIN_CONFIG = {
+    'train_dir': '../../data/train',
+    'valid_dir': '../../data/valid',
+    # 解码分片缓存目录 / tar 分片目录，传给 get_data_loaders，最多指定一个
+    'cache_dir': None,
+    'tar_dir': None,
+    'epochs': 100,
+    'patience': 10,
+    'lr': 1e-3,
+    'step_size': 7,
+    'gamma': 0.1,
+    'accumulation_steps': 1,
+    'amp': None,
+    'num_threads': None,
+    'num_interop_threads': None,
+    'keep_last': 3,
+    'resume': True,
+}
+
+# 各模型与默认值不同的配置，与原 train_*.py 中的设置一致
+MODEL_DEFAULTS = {
+    'efficientnet_b0': {'batch_size': 32},
+}
+
+# 数据来源的配置键，与 DEFAULT_LOADER_CONFIG 中的键一起传给 get_data_loaders
+DATA_SOURCE_KEYS = ('cache_dir', 'tar_dir')
+
+AMP_DTYPES = {
+    'bf16': torch.bfloat16,
+}
+
+
+def load_train_config(model_name, config_path=None, **overrides):
+    """
+    生成某个模型的训练配置，优先级：命令行参数 > 配置文件 > 模型默认值 > DEFAULT_TRAIN_CONFIG
+
+    配置文件为 JSON，可以在 "models" 下为每个模型单独指定配置，例如
+    {"batch_size": 64, "models": {"resnet50": {"batch_size": 16}}}
+    """
+    config = dict(DEFAULT_TRAIN_CONFIG)
+    config.update(load_loader_config(**MODEL_DEFAULTS.get(model_name, {})))
+    config['model'] = model_name
+    config['experiment_dir'] = f'../../experiments/{model_name}'
+    if config_path:
+        with open(config_path) as f:
+            file_config = json.load(f)
+        per_model = file_config.pop('models', {})
+        config.update(file_config)
+        config.update(per_model.get(model_name, {}))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process():
+    """
+    单进程训练或多进程训练的 rank 0 返回 True；只有主进程输出日志、写 TensorBoard 和保存检查点
+    """
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def print_main(*args, **kwargs):
+    if is_main_process():
+        print(*args, **kwargs)
+
+
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """
+    设置 PyTorch 的算子内 / 算子间线程数，为 None 时保持默认
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # 算子间线程池启动后不能再修改
+            print("警告: 算子间线程数只能在并行计算开始前设置，已忽略 num_interop_threads")
+
+
+def prepare_model(model_name, num_classes):
+    """
+    构建模型，冻结预训练的特征提取部分，仅训练分类层
+    """
+    model = build_model(model_name, num_classes)
+
+    # 冻结预训练模型的所有层
+    for param in model.parameters():
+        param.requires_grad = False
+
+    # 解冻分类层的参数以进行训练（ResNet 为 fc，其余为 classifier）
+    head = getattr(model, get_head_name(model))
+    if not isinstance(head, (nn.Linear, nn.Sequential)):
+        raise ValueError("未知的分类器结构")
+    head.requires_grad_(True)
+    return model
+
+
+class ModelTrainer:
+    """
+    单个模型的训练状态：优化器、调度器、早停计数、指标、TensorBoard 和检查点
+
+    多个 ModelTrainer 可以共用同一个数据加载器，每个批次只加载一次，依次送入各个模型。
+    resume=True 时从最近一次保存的完整训练状态继续训练。
+    多进程训练时 model 为 DistributedDataParallel，检查点中保存的是内部模型的权重
+    """
+
+    def __init__(self, name, model, criterion, optimizer, scheduler, experiment_dir, patience=10,
+                 device='cpu', accumulation_steps=1, amp_dtype=None, keep_last=3, resume=True):
+        self.name = name
+        self.model = model
+        self.module = model.module if isinstance(model, DistributedDataParallel) else model
+        self.is_main = is_main_process()
+        self.criterion = criterion
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.experiment_dir = experiment_dir
+        self.patience = patience
+        self.device = device
+        self.accumulation_steps = accumulation_steps
+        self.amp_dtype = amp_dtype
+
+        self.best_loss = float('inf')
+        self.epochs_no_improve = 0
+        self.stopped = False
+        self.start_epoch = 0
+        # 本模型自己的随机数状态（Dropout 等），只在本模型的前向 / 反向中使用，
+        # 多个模型共用数据加载时互不影响；数据加载使用全局随机数
+        self.rng = get_rng_state()
+        # 恢复训练时检查点中的全局随机数状态，由 train_models 统一恢复
+        self.resumed_rng = None
+        # 记录每个 epoch 的指标
+        self.metrics = {
+            'epoch': [],
+            'train_loss': [],
+            'train_acc': [],
+            'train_images_per_sec': [],
+            'valid_loss': [],
+            'valid_acc': [],
+            'valid_images_per_sec': [],
+        }
+
+        # 初始化 TensorBoard（只在主进程）
+        self.writer = SummaryWriter(log_dir=os.path.join(experiment_dir, 'logs')) if self.is_main else None
+
+        # 检查点在后台线程中由主进程写入；恢复训练时每个进程都读取同一份检查点
+        self.checkpoints = CheckpointManager(os.path.join(experiment_dir, 'checkpoints'), keep_last=keep_last)
+        self.checkpoint_path = self.checkpoints.best_path
+        state = self.checkpoints.load_latest(map_location=device) if resume else None
+        if state is not None:
+            self.load_state_dict(state)
+        elif os.path.exists(self.checkpoint_path):
+            # 只有最佳模型权重时沿用原来的做法：加载权重后重新开始训练
+            self.log(f"加载最佳模型检查点: {self.checkpoint_path}")
+            self.module.load_state_dict(torch.load(self.checkpoint_path, map_location=device))
+
+    def log(self, message):
+        if self.is_main:
+            print(f'[{self.name}] {message}')
+
+    def state_dict(self, epoch):
+        """
+        完整训练状态，恢复后从 epoch + 1 继续
+        """
+        return {
+            'epoch': epoch,
+            'model': self.module.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.scheduler.state_dict(),
+            'best_loss': self.best_loss,
+            'epochs_no_improve': self.epochs_no_improve,
+            'stopped': self.stopped,
+            'metrics': self.metrics,
+            'rng': get_rng_state(),
+            'model_rng': self.rng,
+        }
+
+    def load_state_dict(self, state):
+        self.module.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.scheduler.load_state_dict(state['scheduler'])
+        self.best_loss = state['best_loss']
+        self.epochs_no_improve = state['epochs_no_improve']
+        self.stopped = state['stopped']
+        self.metrics = state['metrics']
+        # 全局随机数状态是所有模型共用的，不在这里恢复，否则最后一个恢复的模型会覆盖其他模型
+        self.resumed_rng = state['rng']
+        self.rng = state.get('model_rng', state['rng'])
+        self.start_epoch = state['epoch'] + 1
+
+    def is_active(self, epoch):
+        return not self.stopped and epoch >= self.start_epoch
+
+    def begin_phase(self, phase, num_classes):
+        self.training = phase == 'train'
+        self.model.train(self.training)
+        # 损失和正确数在设备上累加，阶段结束时才取回
+        self.accumulator = MetricAccumulator(num_classes, device=self.device)
+        self.compute_seconds = 0.0
+        if self.training:
+            self.optimizer.zero_grad(set_to_none=True)
+
+    def step(self, inputs, labels, batch_idx, num_batches):
+        """
+        处理一个批次；训练时每 accumulation_steps 个批次更新一次参数，
+        等效批大小为 batch_size * accumulation_steps
+        """
+        since = time.perf_counter()
+        if self.amp_dtype is not None:
+            autocast = torch.autocast(device_type=torch.device(self.device).type, dtype=self.amp_dtype)
+        else:
+            autocast = contextlib.nullcontext()
+
+        update = self.training and ((batch_idx + 1) % self.accumulation_steps == 0 or batch_idx + 1 == num_batches)
+        if self.training and not update and self.model is not self.module:
+            # 梯度累积的中间批次不做 all-reduce，到更新参数的批次再同步
+            sync = self.model.no_sync()
+        else:
+            sync = contextlib.nullcontext()
+        # 验证阶段直接使用内部模型，不需要 DDP 的同步
+        model = self.model if self.training else self.module
+
+        # 前向传播
+        with sync, use_rng_state(self.rng):
+            with torch.set_grad_enabled(self.training), autocast:
+                outputs = model(inputs)
+                loss = self.criterion(outputs, labels)
+
+            # 反向传播
+            if self.training:
+                (loss / self.accumulation_steps).backward()
+
+        # 优化
+        if update:
+            self.optimizer.step()
+            self.optimizer.zero_grad(set_to_none=True)
+
+        self.accumulator.update(outputs, labels, loss)
+        self.compute_seconds += time.perf_counter() - since
+
+    def end_phase(self, phase, epoch, seconds, monitor):
+        if phase == 'train':
+            self.scheduler.step()
+
+        # 多进程训练时先汇总各进程的结果，保证所有进程的早停判断一致
+        self.accumulator.all_reduce()
+        stats = self.accumulator.compute()
+        epoch_loss = stats['loss']
+        epoch_acc = stats['acc']
+        images_per_sec = stats['count'] / seconds if seconds > 0 else 0.0
+
+        self.log(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} '
+                 f'({images_per_sec:.1f} 张/秒，模型计算 {self.compute_seconds:.1f}s)')
+
+        # 记录指标
+        self.metrics[f'{phase}_loss'].append(epoch_loss)
+        self.metrics[f'{phase}_acc'].append(epoch_acc)
+        self.metrics[f'{phase}_images_per_sec'].append(images_per_sec)
+        if self.writer is not None:
+            monitor.log_to_tensorboard(self.writer, phase, epoch)
+            self.writer.add_scalar(f'Loss/{phase.capitalize()}', epoch_loss, epoch)
+            self.writer.add_scalar(f'Accuracy/{phase.capitalize()}', epoch_acc, epoch)
+            self.writer.add_scalar(f'Throughput/{phase.capitalize()}', images_per_sec, epoch)
+
+        if phase == 'valid':
+            # 检查是否为最佳模型
+            if epoch_loss < self.best_loss:
+                self.best_loss = epoch_loss
+                if self.is_main:
+                    self.checkpoints.save_best(self.module.state_dict())
+                self.log(f'验证集损失降低，模型将保存为 {self.checkpoint_path}')
+                self.epochs_no_improve = 0
+            else:
+                self.epochs_no_improve += 1
+                self.log(f'验证集损失未降低，当前早停计数: {self.epochs_no_improve}/{self.patience}')
+
+    def end_epoch(self, epoch):
+        # 记录 epoch
+        self.metrics['epoch'].append(epoch + 1)
+
+        # 检查早停条件
+        if self.epochs_no_improve >= self.patience:
+            self.log('早停条件满足，停止训练')
+            self.stopped = True
+
+        # 每个 epoch 结束时保存完整训练状态，进程被杀掉后可以从这里继续
+        if self.is_main:
+            self.checkpoints.save(self.state_dict(epoch), epoch + 1)
+
+    def finish(self, time_elapsed):
+        self.checkpoints.close()
+        if self.is_main:
+            self.writer.close()
+            self.log(f'最佳验证损失: {self.best_loss:.4f}')
+
+            # 保存指标到 CSV
+            csv_path = os.path.join(self.experiment_dir, 'results/metrics.csv')
+            save_metrics_to_csv(self.metrics, csv_path)
+            self.log(f'训练指标已保存到 {csv_path}')
+
+            # 保存 total_time 到文本文件
+            with open(os.path.join(self.experiment_dir, 'results/total_time.txt'), 'w') as f:
+                f.write(f"Total training time: {time_elapsed // 60:.0f} minutes {time_elapsed % 60:.0f} seconds")
+
+        if is_distributed():
+            # 等主进程写完最佳模型后其他进程再读取
+            dist.barrier()
+
+        # 加载最佳模型权重
+        if self.best_loss < float('inf'):
+            self.module.load_state_dict(torch.load(self.checkpoint_path, map_location=self.device))
+        return self.module, self.metrics
+
+
+def run_epoch(trainers, loader, phase, epoch, device='cpu'):
+    """
+    对数据跑一个阶段（训练或验证）：每个批次只加载一次，依次送入所有未早停的模型
+    """
+    trainers = [trainer for trainer in trainers if trainer.is_active(epoch)]
+    num_classes = len(loader.dataset.classes)
+
+    # 多进程训练时每个 epoch 重新划分数据，保证各进程的打乱顺序一致且互不重叠；
+    # 流式数据集（tar 分片）单进程时也需要，persistent_workers 下每个 epoch 才会换一种顺序
+    if hasattr(loader.sampler, 'set_epoch'):
+        loader.sampler.set_epoch(epoch)
+    elif hasattr(loader.dataset, 'set_epoch'):
+        loader.dataset.set_epoch(epoch)
+
+    for trainer in trainers:
+        trainer.begin_phase(phase, num_classes)
+
+    monitor = LoaderStallMonitor()
+    num_batches = len(loader)
+    since = time.perf_counter()
+
+    # 迭代数据，同时记录数据等待时间和计算时间
+    for batch_idx, (inputs, labels) in enumerate(tqdm(monitor.wrap(loader), desc=phase, total=num_batches,
+                                                      disable=not is_main_process())):
+        inputs = inputs.to(device)
+        labels = labels.to(device)
+        for trainer in trainers:
+            trainer.step(inputs, labels, batch_idx, num_batches)
+
+    seconds = time.perf_counter() - since
+    print_main(f'{phase} {monitor.format_summary()}')
+    for trainer in trainers:
+        trainer.end_phase(phase, epoch, seconds, monitor)
+
+
+def train_models(trainers, dataloaders, num_epochs=50, device='cpu'):
+    """
+    同时训练多个模型，所有模型都早停后结束；返回 {模型名称: (model, metrics)}
+    """
+    since = time.time()
+
+    # 数据加载（打乱、增强）使用全局随机数，所有模型共用一份，从最近保存的检查点恢复
+    resumed = [trainer for trainer in trainers if trainer.resumed_rng is not None]
+    if resumed:
+        set_rng_state(max(resumed, key=lambda trainer: trainer.start_epoch).resumed_rng)
+
+    start_epoch = min(trainer.start_epoch for trainer in trainers)
+    for epoch in range(start_epoch, num_epochs):
+        if all(trainer.stopped for trainer in trainers):
+            break
+
+        print_main(f'Epoch {epoch+1}/{num_epochs}')
+        print_main('-' * 10)
+
+        # 每个 epoch 包含训练和验证阶段
+        for phase in ['train', 'valid']:
+            run_epoch(trainers, dataloaders[phase], phase, epoch, device=device)
+
+        for trainer in trainers:
+            if trainer.is_active(epoch):
+                trainer.end_epoch(epoch)
+
+        print_main()
+
+    time_elapsed = time.time() - since
+    print_main(f'训练完成，耗时 {time_elapsed // 60:.0f} 分 {time_elapsed % 60:.0f} 秒')
+    return {trainer.name: trainer.finish(time_elapsed) for trainer in trainers}
+
+
+def train_model(model, dataloaders, criterion, optimizer, scheduler, experiment_dir, num_epochs=50, patience=10,
+                device='cpu', accumulation_steps=1, amp_dtype=None, name='model', keep_last=3, resume=True):
+    """
+    训练单个模型，返回 (model, metrics)
+    """
+    trainer = ModelTrainer(name, model, criterion, optimizer, scheduler, experiment_dir, patience=patience,
+                           device=device, accumulation_steps=accumulation_steps, amp_dtype=amp_dtype,
+                           keep_last=keep_last, resume=resume)
+    return train_models([trainer], dataloaders, num_epochs=num_epochs, device=device)[name]
+
+
+def build_trainer(config, num_classes, device):
+    """
+    按配置构建模型、损失函数、优化器和学习率调度器，返回 ModelTrainer
+    """
+    if config['amp'] is not None and config['amp'] not in AMP_DTYPES:
+        raise ValueError(f"不支持的混合精度类型: {config['amp']}，可选: {', '.join(AMP_DTYPES)}")
+
+    model = prepare_model(config['model'], num_classes).to(device)
+    if is_distributed():
+        # 只有分类层需要梯度，DDP 只对这些参数做 all-reduce
+        model = DistributedDataParallel(model)
+
+    # 定义损失函数、优化器和学习率调度器
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=config['lr'])
+    scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=config['step_size'], gamma=config['gamma'])
+
+    # 检查并创建必要的文件夹
+    experiment_dir = config['experiment_dir']
+    for sub_dir in ('checkpoints', 'results', 'logs'):
+        os.makedirs(os.path.join(experiment_dir, sub_dir), exist_ok=True)
+
+    print_main(f"训练 {config['model']}: batch_size={config['batch_size']}, "
+          f"accumulation_steps={config['accumulation_steps']}, amp={config['amp']}")
+    return ModelTrainer(config['model'], model, criterion, optimizer, scheduler, experiment_dir,
+                        patience=config['patience'], device=device,
+                        accumulation_steps=config['accumulation_steps'], amp_dtype=AMP_DTYPES.get(config['amp']),
+                        keep_last=config['keep_last'], resume=config['resume'])
+
+
+def run_training(configs):
+    """
+    按配置训练一个或多个模型，返回 {模型名称: (model, metrics)}
+
+    传入多个配置时所有模型共用一次数据加载：数据目录、批大小、epoch 数、线程数等
+    数据相关的设置取第一个配置，学习率、早停、梯度累积和混合精度等按各自的配置
+    """
+    if isinstance(configs, dict):
+        configs = [configs]
+    data_config = configs[0]
+    for config in configs[1:]:
+        if config['batch_size'] != data_config['batch_size']:
+            print_main(f"警告: {config['model']} 的 batch_size ({config['batch_size']}) 与共用的数据加载器不同，"
+                  f"使用 {data_config['batch_size']}")
+
+    configure_threads(data_config['num_threads'], data_config['num_interop_threads'])
+    print_main(f'线程数: {torch.get_num_threads()}')
+
+    # 获取数据加载器和类别名称；多进程训练时每个进程只读取自己的那部分数据
+    loader_config = {key: data_config[key] for key in (*DEFAULT_LOADER_CONFIG, *DATA_SOURCE_KEYS)}
+    dataloaders, class_names = get_data_loaders(data_config['train_dir'], data_config['valid_dir'], **loader_config,
+                                                distributed=is_distributed())
+
+    # 检查是否有可用的 GPU；多进程训练使用 gloo 后端，在 CPU 上进行
+    device = torch.device("cuda" if torch.cuda.is_available() and not is_distributed() else "cpu")
+    trainers = [build_trainer(config, len(class_names), device) for config in configs]
+    return train_models(trainers, dataloaders, num_epochs=data_config['epochs'], device=device)
+
+
+def print_throughput_summary(results):
+    """
+    打印各模型训练 / 验证阶段的平均吞吐量，便于比较不同配置
+    """
+    print(f"{'模型':<20}{'训练 张/秒':>12}{'验证 张/秒':>12}{'最佳验证损失':>14}")
+    for model_name, metrics in results.items():
+        train_ips = sum(metrics['train_images_per_sec']) / max(len(metrics['train_images_per_sec']), 1)
+        valid_ips = sum(metrics['valid_images_per_sec']) / max(len(metrics['valid_images_per_sec']), 1)
+        best_loss = min(metrics['valid_loss'], default=float('nan'))
+        print(f"{model_name:<20}{train_ips:>12.1f}{valid_ips:>12.1f}{best_loss:>14.4f}")
+
+
+def build_arg_parser(description="按配置训练一个或多个模型的分类层"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--model', nargs='+', required=True, choices=list(MODEL_BUILDERS),
+                        help='模型名称，可指定多个依次训练并比较吞吐量')
+    parser.add_argument('--single-pass', action='store_true',
+                        help='多个模型共用一次数据加载，每个批次依次送入所有模型')
+    parser.add_argument('--config', help='JSON 配置文件')
+    parser.add_argument('--train-dir')
+    parser.add_argument('--valid-dir')
+    parser.add_argument('--cache-dir', help='解码分片缓存目录，不存在时先解码一次，之后不再重复解码 JPEG')
+    parser.add_argument('--tar-dir', help='tar 分片目录，不存在时先打包，之后顺序流式读取')
+    parser.add_argument('--experiment-dir', help='实验目录，只训练一个模型时有效')
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--accumulation-steps', type=int, help='梯度累积步数')
+    parser.add_argument('--epochs', type=int)
+    parser.add_argument('--patience', type=int)
+    parser.add_argument('--lr', type=float)
+    parser.add_argument('--amp', choices=list(AMP_DTYPES), help='autocast 的精度，CPU 上可用 bf16')
+    parser.add_argument('--num-threads', type=int, help='算子内线程数 (torch.set_num_threads)')
+    parser.add_argument('--num-interop-threads', type=int, help='算子间线程数')
+    parser.add_argument('--num-workers', type=int, help='DataLoader 的 worker 数')
+    parser.add_argument('--batch-augment', action='store_true', default=None, help='按批次做数据增强')
+    parser.add_argument('--keep-last', type=int, help='保留最近几个 epoch 的完整训练状态')
+    parser.add_argument('--no-resume', dest='resume', action='store_false', default=None,
+                        help='不从已保存的训练状态继续，重新开始训练')
+    return parser
+
+
+def configs_from_args(args):
+    """
+    由命令行参数生成每个模型的训练配置
+    """
+    if args.experiment_dir and len(args.model) > 1:
+        raise ValueError('--experiment-dir 只能在训练一个模型时使用')
+    config_keys = set(DEFAULT_TRAIN_CONFIG) | set(DEFAULT_LOADER_CONFIG) | {'experiment_dir'}
+    overrides = {key: value for key, value in vars(args).items() if key in config_keys}
+    return [load_train_config(model_name, args.config, **overrides) for model_name in args.model]
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    try:
+        configs = configs_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.single_pass:
+        trained = run_training(configs)
+    else:
+        trained = {}
+        for config in configs:
+            trained.update(run_training(config))
+
+    results = {model_name: metrics for model_name, (_, metrics) in trained.items()}
+
+    print_throughput_summary(results)
+
+
+if __name__ == '__main__':
+    main()
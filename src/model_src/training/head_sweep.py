@@ -0,0 +1,192 @@
+# src/training/head_sweep.py
+
+import itertools
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from tqdm import tqdm
+
+
+def make_sweep_configs(lrs, weight_decays=(0.0,), label_smoothings=(0.0,)):
+    """
+    生成超参数网格，每个元素为 {'lr', 'weight_decay', 'label_smoothing'}
+    """
+    return [{'lr': lr, 'weight_decay': weight_decay, 'label_smoothing': label_smoothing}
+            for lr, weight_decay, label_smoothing in itertools.product(lrs, weight_decays, label_smoothings)]
+
+
+class StackedHead(nn.Module):
+    """
+    把 K 份结构相同的分类层堆叠为一组参数，一次 bmm 同时计算 K 个分类层的输出
+
+    head 可以是 nn.Linear，也可以是由 Linear 和逐元素层（激活、Dropout）组成的 nn.Sequential
+    （如 MobileNetV3 的 classifier）。K 份参数都从 head 当前的权重初始化
+    """
+
+    def __init__(self, head, num_heads):
+        super().__init__()
+        named_layers = list(head.named_children()) if isinstance(head, nn.Sequential) else [('', head)]
+        self.num_heads = num_heads
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        self.elementwise = nn.ModuleList()
+        # plan 中的每一项为 ('linear', 参数下标, state_dict 前缀) 或 ('elementwise', 模块下标, None)
+        self.plan = []
+        for name, layer in named_layers:
+            if isinstance(layer, nn.Linear):
+                weight = layer.weight.detach().t().unsqueeze(0).repeat(num_heads, 1, 1)
+                if layer.bias is not None:
+                    bias = layer.bias.detach().view(1, 1, -1).repeat(num_heads, 1, 1)
+                else:
+                    bias = torch.zeros(num_heads, 1, layer.out_features, device=weight.device)
+                self.weights.append(nn.Parameter(weight.contiguous()))
+                self.biases.append(nn.Parameter(bias.contiguous()))
+                self.plan.append(('linear', len(self.weights) - 1, f'{name}.' if name else ''))
+            else:
+                self.elementwise.append(layer)
+                self.plan.append(('elementwise', len(self.elementwise) - 1, None))
+
+    def forward(self, x):
+        """
+        x: (N, D) 特征，返回 (K, N, num_classes)
+        """
+        x = x.unsqueeze(0).expand(self.num_heads, -1, -1)
+        for kind, index, _ in self.plan:
+            if kind == 'linear':
+                x = torch.baddbmm(self.biases[index], x, self.weights[index])
+            else:
+                x = self.elementwise[index](x)
+        return x
+
+    def head_state_dict(self, k):
+        """
+        取出第 k 个分类层的权重，格式与原 head.state_dict() 相同
+        """
+        state = {}
+        for kind, index, prefix in self.plan:
+            if kind == 'linear':
+                state[f'{prefix}weight'] = self.weights[index][k].detach().t().clone()
+                state[f'{prefix}bias'] = self.biases[index][k, 0].detach().clone()
+        return state
+
+
+class BatchedAdam:
+    """
+    对堆叠参数做 Adam 更新，每个分类层使用自己的学习率和 weight decay
+
+    更新公式与 torch.optim.Adam 相同（weight decay 为加到梯度上的 L2 项）
+    """
+
+    def __init__(self, params, lrs, weight_decays, betas=(0.9, 0.999), eps=1e-8):
+        self.params = list(params)
+        device = self.params[0].device
+        self.lrs = torch.tensor(lrs, dtype=torch.float32, device=device)
+        self.weight_decays = torch.tensor(weight_decays, dtype=torch.float32, device=device)
+        self.betas = betas
+        self.eps = eps
+        self.step_count = 0
+        self.exp_avgs = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sqs = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self, lr_scale=1.0):
+        beta1, beta2 = self.betas
+        self.step_count += 1
+        bias_correction1 = 1 - beta1 ** self.step_count
+        bias_correction2 = 1 - beta2 ** self.step_count
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avgs, self.exp_avg_sqs):
+            if p.grad is None:
+                continue
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            grad = p.grad + self.weight_decays.view(shape) * p
+            exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            denom = (exp_avg_sq / bias_correction2).sqrt_().add_(self.eps)
+            step_size = (self.lrs * lr_scale / bias_correction1).view(shape)
+            p.sub_(step_size * exp_avg / denom)
+
+
+def stacked_loss(outputs, labels, label_smoothings):
+    """
+    每个分类层各自的交叉熵（支持各自的 label smoothing），返回 (K,) 平均损失
+    """
+    log_probs = F.log_softmax(outputs.float(), dim=-1)
+    nll = -log_probs.gather(-1, labels.view(1, -1, 1).expand(outputs.size(0), -1, 1)).squeeze(-1)
+    smooth = -log_probs.mean(dim=-1)
+    eps = label_smoothings.view(-1, 1)
+    return ((1 - eps) * nll + eps * smooth).mean(dim=1)
+
+
+def sweep_heads(head, dataloaders, configs, num_epochs=100, patience=10, step_size=7, gamma=0.1, device='cpu'):
+    """
+    在缓存的特征上同时训练 len(configs) 个分类层
+
+    学习率按与 train_head 相同的 StepLR(step_size, gamma) 衰减；验证损失使用不带 label smoothing 的交叉熵，
+    以便不同配置之间可以比较。所有配置都连续 patience 个 epoch 没有改善时提前结束。
+    返回 (results, best_states)：results 为每个配置的最佳验证损失、准确率和 epoch，
+    best_states 为每个配置在最佳 epoch 时的 head.state_dict()
+    """
+    num_heads = len(configs)
+    stacked = StackedHead(head, num_heads).to(device)
+    optimizer = BatchedAdam(stacked.parameters(), [c['lr'] for c in configs], [c['weight_decay'] for c in configs])
+    label_smoothings = torch.tensor([c['label_smoothing'] for c in configs], device=device)
+    no_smoothing = torch.zeros_like(label_smoothings)
+
+    best_losses = torch.full((num_heads,), float('inf'))
+    best_accs = torch.zeros(num_heads)
+    best_epochs = torch.zeros(num_heads, dtype=torch.long)
+    epochs_no_improve = torch.zeros(num_heads, dtype=torch.long)
+    best_states = [stacked.head_state_dict(k) for k in range(num_heads)]
+
+    for epoch in range(num_epochs):
+        lr_scale = gamma ** (epoch // step_size)
+
+        stacked.train()
+        for inputs, labels in tqdm(dataloaders['train'], desc=f'sweep {epoch + 1}/{num_epochs}', leave=False):
+            inputs, labels = inputs.to(device), labels.to(device)
+            # 各分类层的参数互不相关，对损失求和后一次反向即可得到每个分类层各自的梯度
+            loss = stacked_loss(stacked(inputs), labels, label_smoothings).sum()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step(lr_scale)
+
+        stacked.eval()
+        loss_sums = torch.zeros(num_heads, dtype=torch.float64, device=device)
+        corrects = torch.zeros(num_heads, dtype=torch.long, device=device)
+        count = 0
+        with torch.no_grad():
+            for inputs, labels in dataloaders['valid']:
+                inputs, labels = inputs.to(device), labels.to(device)
+                outputs = stacked(inputs)
+                loss_sums += stacked_loss(outputs, labels, no_smoothing).double() * labels.size(0)
+                corrects += (outputs.argmax(dim=-1) == labels.unsqueeze(0)).sum(dim=1)
+                count += labels.size(0)
+        valid_losses = (loss_sums / count).float().cpu()
+        valid_accs = (corrects.double() / count).float().cpu()
+
+        improved = valid_losses < best_losses
+        for k in improved.nonzero().flatten().tolist():
+            best_states[k] = stacked.head_state_dict(k)
+        best_losses = torch.where(improved, valid_losses, best_losses)
+        best_accs = torch.where(improved, valid_accs, best_accs)
+        best_epochs = torch.where(improved, torch.full_like(best_epochs, epoch + 1), best_epochs)
+        epochs_no_improve = torch.where(improved, torch.zeros_like(epochs_no_improve), epochs_no_improve + 1)
+
+        best = int(valid_losses.argmin())
+        print(f'Epoch {epoch + 1}/{num_epochs} 最佳配置 #{best}: Loss: {valid_losses[best]:.4f} '
+              f'Acc: {valid_accs[best]:.4f}，{int(improved.sum())}/{num_heads} 个配置有改善')
+
+        if bool((epochs_no_improve >= patience).all()):
+            print('所有配置都满足早停条件，停止训练')
+            break
+
+    results = []
+    for k, config in enumerate(configs):
+        results.append(dict(config, best_valid_loss=float(best_losses[k]), best_valid_acc=float(best_accs[k]),
+                            best_epoch=int(best_epochs[k])))
+    return results, best_states
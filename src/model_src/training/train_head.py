@@ -0,0 +1,198 @@
+# src/training/train_head.py
+
+import argparse
+import copy
+import os
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from tqdm import tqdm
+from torchvision import datasets
+from torch.utils.tensorboard import SummaryWriter
+
+from src.models import MODEL_BUILDERS, build_model, get_head_name, split_head
+from src.training.head_sweep import make_sweep_configs, sweep_heads
+from src.utils.feature_cache import build_feature_cache, cache_signature, get_feature_loaders, is_feature_cache_ready
+from src.utils.metrics import calculate_accuracy
+from src.utils.visualization import save_metrics_to_csv
+
+
+def train_head(head, dataloaders, criterion, optimizer, scheduler, writer, num_epochs=100, patience=10,
+               device='cpu', on_improve=None):
+    """
+    只训练分类层：输入是缓存好的特征而不是图片，每个 epoch 只需几秒
+    """
+    best_head_wts = copy.deepcopy(head.state_dict())
+    best_loss = float('inf')
+    epochs_no_improve = 0
+    metrics = {'epoch': [], 'train_loss': [], 'train_acc': [], 'valid_loss': [], 'valid_acc': []}
+
+    for epoch in range(num_epochs):
+        print(f'Epoch {epoch+1}/{num_epochs}')
+        print('-' * 10)
+
+        for phase in ['train', 'valid']:
+            if phase == 'train':
+                head.train()
+            else:
+                head.eval()
+
+            running_loss = 0.0
+            running_corrects = 0
+
+            for inputs, labels in tqdm(dataloaders[phase], desc=phase, leave=False):
+                inputs = inputs.to(device)
+                labels = labels.to(device)
+
+                with torch.set_grad_enabled(phase == 'train'):
+                    outputs = head(inputs)
+                    loss = criterion(outputs, labels)
+                    acc = calculate_accuracy(outputs, labels)
+
+                    if phase == 'train':
+                        optimizer.zero_grad()
+                        loss.backward()
+                        optimizer.step()
+
+                running_loss += loss.item() * inputs.size(0)
+                running_corrects += acc.item() * inputs.size(0)
+
+            if phase == 'train':
+                scheduler.step()
+
+            epoch_loss = running_loss / len(dataloaders[phase].dataset)
+            epoch_acc = running_corrects / len(dataloaders[phase].dataset)
+            print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+
+            metrics[f'{phase}_loss'].append(epoch_loss)
+            metrics[f'{phase}_acc'].append(epoch_acc)
+            writer.add_scalar(f'Loss/{phase.capitalize()}', epoch_loss, epoch)
+            writer.add_scalar(f'Accuracy/{phase.capitalize()}', epoch_acc, epoch)
+
+            if phase == 'valid':
+                if epoch_loss < best_loss:
+                    best_loss = epoch_loss
+                    best_head_wts = copy.deepcopy(head.state_dict())
+                    epochs_no_improve = 0
+                    if on_improve is not None:
+                        on_improve()
+                else:
+                    epochs_no_improve += 1
+                    print(f'验证集损失未降低，当前早停计数: {epochs_no_improve}/{patience}')
+
+        metrics['epoch'].append(epoch + 1)
+        if epochs_no_improve >= patience:
+            print('早停条件满足，停止训练')
+            break
+
+    print(f'最佳验证损失: {best_loss:.4f}')
+    head.load_state_dict(best_head_wts)
+    return head, metrics
+
+
+def run_sweep(args, model, head, dataloaders, experiment_dir, checkpoint_path, device):
+    """
+    同时训练一组超参数不同的分类层，保存搜索结果，并把验证损失最低的分类层导出为 best_model.pth
+    """
+    configs = make_sweep_configs(args.sweep_lrs, args.sweep_weight_decays, args.sweep_label_smoothings)
+    print(f'超参数搜索: 共 {len(configs)} 个配置')
+
+    since = time.time()
+    results, best_states = sweep_heads(head, dataloaders, configs, num_epochs=args.epochs,
+                                       patience=args.patience, device=device)
+    time_elapsed = time.time() - since
+    print(f'搜索完成，耗时 {time_elapsed // 60:.0f} 分 {time_elapsed % 60:.0f} 秒')
+
+    for k, result in enumerate(results):
+        print(f"#{k} lr={result['lr']:g} weight_decay={result['weight_decay']:g} "
+              f"label_smoothing={result['label_smoothing']:g}: Loss: {result['best_valid_loss']:.4f} "
+              f"Acc: {result['best_valid_acc']:.4f} (epoch {result['best_epoch']})")
+
+    csv_path = os.path.join(experiment_dir, 'results/head_sweep.csv')
+    save_metrics_to_csv({key: [result[key] for result in results] for key in results[0]}, csv_path)
+    print(f'搜索结果已保存到 {csv_path}')
+
+    best = min(range(len(results)), key=lambda k: results[k]['best_valid_loss'])
+    head.load_state_dict(best_states[best])
+    # 保存完整模型的权重，格式与 train_*.py 一致，可直接被 predict.load_model 加载
+    torch.save(model.state_dict(), checkpoint_path)
+    print(f'最佳配置 #{best} 的模型已保存为 {checkpoint_path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于特征缓存只训练分类层")
+    parser.add_argument('--model', required=True, choices=list(MODEL_BUILDERS), help='模型名称')
+    parser.add_argument('--train-dir', default='../../data/train')
+    parser.add_argument('--valid-dir', default='../../data/valid')
+    parser.add_argument('--cache-dir', help='特征缓存目录，默认 experiments/<model>/feature_cache')
+    parser.add_argument('--num-variants', type=int, default=1, help='训练集每张图片缓存的版本数（含一个无增强版本）')
+    parser.add_argument('--rebuild-cache', action='store_true', help='重新提取特征')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--patience', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--sweep-lrs', type=float, nargs='+',
+                        help='指定后进入超参数搜索模式，同时训练学习率 × weight decay × label smoothing 的所有组合')
+    parser.add_argument('--sweep-weight-decays', type=float, nargs='+', default=[0.0])
+    parser.add_argument('--sweep-label-smoothings', type=float, nargs='+', default=[0.0])
+    args = parser.parse_args()
+
+    experiment_dir = f'../../experiments/{args.model}'
+    cache_dir = args.cache_dir or os.path.join(experiment_dir, 'feature_cache')
+    checkpoint_path = os.path.join(experiment_dir, 'checkpoints/best_model.pth')
+    os.makedirs(os.path.join(experiment_dir, 'checkpoints'), exist_ok=True)
+    os.makedirs(os.path.join(experiment_dir, 'results'), exist_ok=True)
+    os.makedirs(os.path.join(experiment_dir, 'logs'), exist_ok=True)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    # 获取类别数量并构建模型
+    num_classes = len(datasets.ImageFolder(args.train_dir).classes)
+    model = build_model(args.model, num_classes)
+    head_name = get_head_name(model)
+    backbone, head = split_head(model)
+
+    # 特征只需提取一次，之后的训练直接读取缓存
+    # 缓存与当前 backbone 或 --num-variants 不一致时重新提取
+    signature = cache_signature(args.model, backbone, args.num_variants)
+    if args.rebuild_cache or not is_feature_cache_ready(cache_dir, signature):
+        print(f"提取特征到: {cache_dir}")
+        build_feature_cache(backbone, args.train_dir, args.valid_dir, cache_dir,
+                            num_variants=args.num_variants, signature=signature, device=device)
+    setattr(model, head_name, head)
+
+    dataloaders, class_names = get_feature_loaders(cache_dir, batch_size=args.batch_size)
+
+    head = head.to(device)
+
+    if args.sweep_lrs:
+        run_sweep(args, model, head, dataloaders, experiment_dir, checkpoint_path, device)
+        return
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=args.lr)
+    scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=7, gamma=0.1)
+    writer = SummaryWriter(log_dir=os.path.join(experiment_dir, 'logs'))
+
+    def save_checkpoint():
+        # 保存完整模型的权重，格式与 train_*.py 一致，可直接被 predict.load_model 加载
+        torch.save(model.state_dict(), checkpoint_path)
+        print(f'验证集损失降低，模型已保存为 {checkpoint_path}')
+
+    since = time.time()
+    head, metrics = train_head(head, dataloaders, criterion, optimizer, scheduler, writer,
+                               num_epochs=args.epochs, patience=args.patience, device=device,
+                               on_improve=save_checkpoint)
+    writer.close()
+
+    time_elapsed = time.time() - since
+    print(f'训练完成，耗时 {time_elapsed // 60:.0f} 分 {time_elapsed % 60:.0f} 秒')
+
+    csv_path = os.path.join(experiment_dir, 'results/head_metrics.csv')
+    save_metrics_to_csv(metrics, csv_path)
+    print(f'训练指标已保存到 {csv_path}')
+
+
+if __name__ == '__main__':
+    main()
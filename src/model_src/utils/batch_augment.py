@@ -0,0 +1,75 @@
+# src/utils/batch_augment.py
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+class BatchAugment:
+    """
+    对整个 uint8 批次 (N, 3, H, W) 做随机水平翻转、随机旋转和归一化
+
+    翻转和旋转合成一个仿射矩阵，用一次 affine_grid + grid_sample 完成，
+    对应 get_data_transforms 中的 RandomHorizontalFlip、RandomRotation(20) 和 Normalize；
+    旋转露出的区域与 RandomRotation 一样填充黑色。train=False 时只做归一化
+    """
+
+    def __init__(self, train=True, hflip_prob=0.5, degrees=20, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.train = train
+        self.hflip_prob = hflip_prob
+        self.degrees = degrees
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+    def _affine_theta(self, n, height, width, device):
+        angles = (torch.rand(n, device=device) * 2 - 1) * math.radians(self.degrees)
+        flips = torch.where(torch.rand(n, device=device) < self.hflip_prob, -1.0, 1.0)
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        zeros = torch.zeros_like(angles)
+        # grid 使用 [-1, 1] 归一化坐标，非正方形图片需要按宽高比修正旋转项
+        theta = torch.stack([
+            torch.stack([cos * flips, -sin * flips * height / width, zeros], dim=1),
+            torch.stack([sin * width / height, cos, zeros], dim=1),
+        ], dim=1)
+        return theta
+
+    def __call__(self, images):
+        images = images.float().div_(255)
+        if self.train:
+            n, _, height, width = images.shape
+            theta = self._affine_theta(n, height, width, images.device)
+            grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+            images = F.grid_sample(images, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+        mean = self.mean.to(images.device)
+        std = self.std.to(images.device)
+        return images.sub_(mean).div_(std)
+
+
+class BatchTransformLoader:
+    """
+    包装 DataLoader，在每个批次上调用批次变换；其余属性（dataset 等）转发给原 DataLoader
+    """
+
+    def __init__(self, loader, transform, device=None):
+        self.loader = loader
+        self.transform = transform
+        self.device = device
+
+    def __iter__(self):
+        for images, labels in self.loader:
+            if self.device is not None:
+                images = images.to(self.device, non_blocking=True)
+                labels = labels.to(self.device, non_blocking=True)
+            yield self.transform(images), labels
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
@@ -1,14 +1,97 @@
 # src/utils/data_loader.py
 
 import os
+import json
+import torch
+import torch.distributed as dist
 from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler, Sampler
 
-def get_data_loaders(train_dir, valid_dir, batch_size=8, num_workers=0):
+from .batch_augment import BatchAugment, BatchTransformLoader
+from .shard_cache import ShardDataset, build_shard_cache, is_shard_cache_ready
+from .tar_shards import TarShardDataset, is_tar_shards_ready, pack_tar_shards
+
+# 数据加载配置的默认值；num_workers / pin_memory 为 'auto' 时按机器情况自动选择
+DEFAULT_LOADER_CONFIG = {
+    'batch_size': 8,
+    'num_workers': 'auto',
+    'persistent_workers': True,
+    'prefetch_factor': 2,
+    'pin_memory': 'auto',
+    'batch_augment': False,
+}
+
+
+def auto_num_workers():
     """
-    获取训练和验证数据加载器
+    根据可用 CPU 核数选择 worker 数，留一个核给主进程做前向和反向计算；
+    同一台机器上有多个训练进程时（LOCAL_WORLD_SIZE）按进程数平分
+    """
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_cpus = os.cpu_count() or 1
+    num_cpus //= int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    return max(0, min(num_cpus - 1, 8))
+
+
+def load_loader_config(config_path=None, **defaults):
+    """
+    读取数据加载配置，优先级：配置文件 > 调用方给出的默认值 > DEFAULT_LOADER_CONFIG
+
+    config_path 未指定时读取环境变量 DATA_LOADER_CONFIG 指向的 JSON 文件（如果有）
+    """
+    config = dict(DEFAULT_LOADER_CONFIG)
+    config.update(defaults)
+    config_path = config_path or os.environ.get('DATA_LOADER_CONFIG')
+    if config_path:
+        with open(config_path) as f:
+            config.update(json.load(f))
+    return config
+
+
+class ShardedEvalSampler(Sampler):
     """
-    data_transforms = {
+    多进程验证用的顺序采样器：进程 rank 读取下标 rank, rank + world_size, ...
+
+    与 DistributedSampler 不同，样本数不能整除时不重复样本补齐，各进程的样本数最多相差 1，
+    汇总后每个样本恰好被评估一次，验证指标与单进程一致
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_samples = len(dataset)
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def __iter__(self):
+        return iter(range(self.rank, self.num_samples, self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, self.num_samples, self.num_replicas))
+
+
+def _loader_kwargs(batch_size, num_workers, persistent_workers, prefetch_factor, pin_memory):
+    if num_workers in (None, 'auto'):
+        num_workers = auto_num_workers()
+    if pin_memory == 'auto':
+        pin_memory = torch.cuda.is_available()
+    kwargs = {'batch_size': batch_size, 'num_workers': num_workers, 'pin_memory': pin_memory}
+    # persistent_workers 和 prefetch_factor 只在使用子进程时有效
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        kwargs['prefetch_factor'] = prefetch_factor
+    return kwargs
+
+
+def get_data_transforms():
+    """
+    获取训练和验证阶段的图像变换
+    """
+    return {
         'train': transforms.Compose([
             transforms.RandomHorizontalFlip(), # 随机水平翻转
             transforms.RandomRotation(20), # 随机旋转20度
@@ -25,17 +108,128 @@ def get_data_loaders(train_dir, valid_dir, batch_size=8, num_workers=0):
         ]),
     }
 
-    # 加载数据集
-    train_dataset = datasets.ImageFolder(train_dir, transform=data_transforms['train'])
-    valid_dataset = datasets.ImageFolder(valid_dir, transform=data_transforms['valid'])
+
+def get_tensor_transforms():
+    """
+    获取作用于已缩放到 224x224 的 uint8 张量的变换，与 get_data_transforms 对应
+    """
+    return {
+        'train': transforms.Compose([
+            transforms.RandomHorizontalFlip(), # 随机水平翻转
+            transforms.RandomRotation(20), # 随机旋转20度
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406],
+                                 [0.229, 0.224, 0.225]) # 归一化
+        ]),
+        'valid': transforms.Compose([
+            transforms.ConvertImageDtype(torch.float32),
+            transforms.Normalize([0.485, 0.456, 0.406],
+                                 [0.229, 0.224, 0.225])
+        ]),
+    }
+
+
+def get_uint8_transform(size=(224, 224)):
+    """
+    只缩放并转换为 uint8 张量，随机增强和归一化留给 BatchAugment 按批次完成
+    """
+    return transforms.Compose([
+        transforms.Resize(size),
+        transforms.PILToTensor(),
+    ])
+
+
+def get_shard_datasets(train_dir, valid_dir, cache_dir, batch_augment=False):
+    """
+    从解码分片缓存中加载数据集，缓存不存在或源目录有变化时先解码一次
+    """
+    # 分片中已是 uint8 张量，按批次增强时不需要逐样本变换
+    tensor_transforms = {'train': None, 'valid': None} if batch_augment else get_tensor_transforms()
+    split_datasets = []
+    for split, image_dir in [('train', train_dir), ('valid', valid_dir)]:
+        split_cache_dir = os.path.join(cache_dir, split)
+        if not is_shard_cache_ready(split_cache_dir, image_dir=image_dir):
+            print(f"建立解码缓存: {split_cache_dir}")
+            build_shard_cache(image_dir, split_cache_dir)
+        split_datasets.append(ShardDataset(split_cache_dir, transform=tensor_transforms[split]))
+    return split_datasets
+
+
+def get_tar_datasets(train_dir, valid_dir, tar_dir, batch_augment=False):
+    """
+    从 tar 分片流式读取数据集，分片不存在或源目录有变化时先打包
+    """
+    if batch_augment:
+        data_transforms = {'train': get_uint8_transform(), 'valid': get_uint8_transform()}
+    else:
+        data_transforms = get_data_transforms()
+    split_datasets = []
+    for split, image_dir in [('train', train_dir), ('valid', valid_dir)]:
+        split_tar_dir = os.path.join(tar_dir, split)
+        if not is_tar_shards_ready(split_tar_dir, image_dir=image_dir):
+            print(f"打包 tar 分片: {split_tar_dir}")
+            pack_tar_shards(image_dir, split_tar_dir)
+        # 验证集不做梯度同步，多进程时不需要补齐到相同样本数，每个样本只评估一次
+        split_datasets.append(TarShardDataset(split_tar_dir, transform=data_transforms[split],
+                                              shuffle=(split == 'train'), balance_ranks=(split == 'train')))
+    return split_datasets
+
+
+def get_data_loaders(train_dir, valid_dir, batch_size=8, num_workers=0, cache_dir=None, tar_dir=None,
+                     persistent_workers=False, prefetch_factor=2, pin_memory=False, batch_augment=False,
+                     distributed=False):
+    """
+    获取训练和验证数据加载器
+
+    指定 cache_dir 时从预先解码的 uint8 分片读取数据，不再每个 epoch 重复解码 JPEG；
+    指定 tar_dir 时从 tar 分片顺序流式读取，适合无法预先解码的大数据集。
+    num_workers 和 pin_memory 可以为 'auto'，通常通过 get_data_loaders(..., **load_loader_config()) 调用。
+    batch_augment=True 时 worker 只输出缩放后的 uint8 张量，翻转、旋转和归一化在主进程中按整个批次完成。
+    distributed=True 时每个进程只读取数据集的 1/world_size：训练集使用 DistributedSampler
+    （样本数不能整除时重复少量样本补齐，保证各进程的批次数相同）；验证集使用 ShardedEvalSampler，
+    不补齐，每个样本只评估一次
+    """
+    if cache_dir is not None and tar_dir is not None:
+        raise ValueError("cache_dir 和 tar_dir 只能指定一个")
+
+    loader_kwargs = _loader_kwargs(batch_size, num_workers, persistent_workers, prefetch_factor, pin_memory)
+
+    if tar_dir is not None:
+        train_dataset, valid_dataset = get_tar_datasets(train_dir, valid_dir, tar_dir, batch_augment)
+        # 流式数据集由数据集自身负责打乱，DataLoader 不能再设置 shuffle
+        train_loader = DataLoader(train_dataset, **loader_kwargs)
+        valid_loader = DataLoader(valid_dataset, **loader_kwargs)
+        return _wrap_batch_augment(train_loader, valid_loader, batch_augment), train_dataset.classes
+
+    if cache_dir is not None:
+        train_dataset, valid_dataset = get_shard_datasets(train_dir, valid_dir, cache_dir, batch_augment)
+    else:
+        if batch_augment:
+            data_transforms = {'train': get_uint8_transform(), 'valid': get_uint8_transform()}
+        else:
+            data_transforms = get_data_transforms()
+
+        # 加载数据集
+        train_dataset = datasets.ImageFolder(train_dir, transform=data_transforms['train'])
+        valid_dataset = datasets.ImageFolder(valid_dir, transform=data_transforms['valid'])
 
     # 创建数据加载器
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    valid_loader = DataLoader(valid_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    if distributed:
+        train_loader = DataLoader(train_dataset, sampler=DistributedSampler(train_dataset, shuffle=True),
+                                  **loader_kwargs)
+        # 验证阶段只在最后汇总一次结果，各进程批次数不同不会卡住；补齐的重复样本会让指标偏差
+        valid_loader = DataLoader(valid_dataset, sampler=ShardedEvalSampler(valid_dataset), **loader_kwargs)
+    else:
+        train_loader = DataLoader(train_dataset, shuffle=True, **loader_kwargs)
+        valid_loader = DataLoader(valid_dataset, shuffle=False, **loader_kwargs)
+
+    return _wrap_batch_augment(train_loader, valid_loader, batch_augment), train_dataset.classes
 
-    dataloaders = {
-        'train': train_loader,
-        'valid': valid_loader
-    }
 
-    return dataloaders, train_dataset.classes
\ No newline at end of file
+def _wrap_batch_augment(train_loader, valid_loader, batch_augment):
+    if not batch_augment:
+        return {'train': train_loader, 'valid': valid_loader}
+    return {
+        'train': BatchTransformLoader(train_loader, BatchAugment(train=True)),
+        'valid': BatchTransformLoader(valid_loader, BatchAugment(train=False)),
+    }
\ No newline at end of file
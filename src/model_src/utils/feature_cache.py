@@ -0,0 +1,173 @@
+# src/utils/feature_cache.py
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets
+from tqdm import tqdm
+
+from .data_loader import get_data_transforms
+
+MANIFEST_NAME = 'manifest.json'
+
+
+@torch.no_grad()
+def extract_features(backbone, dataset, output_dir, num_variants=1, seed=0,
+                     batch_size=64, num_workers=0, device='cpu', dtype=np.float16):
+    """
+    用冻结的 backbone 对整个数据集提取一次池化特征，保存为内存映射数组
+
+    Args:
+        backbone: 去掉分类层后的模型，输出 (N, D) 特征
+        dataset: ImageFolder 数据集，变换中的随机增强会按 variant 固定随机种子
+        num_variants (int): 每张图片保存的增强版本数 K
+        dtype: 特征的存储类型，float16 可节省一半空间
+
+    生成 output_dir/features.npy (K, N, D)、labels.npy (N,) 和 manifest.json
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    backbone = backbone.to(device).eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    features = None
+    labels = np.empty(len(dataset), dtype=np.int64)
+    for variant in range(num_variants):
+        # 固定随机种子，保证每个增强版本可复现
+        torch.manual_seed(seed + variant)
+        offset = 0
+        for inputs, targets in tqdm(loader, desc=f'提取特征 {variant + 1}/{num_variants}'):
+            outputs = backbone(inputs.to(device)).flatten(1).cpu().numpy()
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    os.path.join(output_dir, 'features.npy'), mode='w+', dtype=dtype,
+                    shape=(num_variants, len(dataset), outputs.shape[1]))
+            features[variant, offset:offset + len(outputs)] = outputs
+            labels[offset:offset + len(outputs)] = targets.numpy()
+            offset += len(outputs)
+
+    features.flush()
+    np.save(os.path.join(output_dir, 'labels.npy'), labels)
+    manifest = {
+        'num_samples': len(dataset),
+        'num_variants': num_variants,
+        'feature_dim': int(features.shape[2]),
+        'dtype': np.dtype(dtype).name,
+        'classes': list(dataset.classes),
+        'seed': seed,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def cache_signature(backbone_name, backbone, num_variants=1):
+    """
+    特征缓存的签名：backbone 名称、权重的 SHA-1 和增强版本数，任一变化时缓存需要重建
+    """
+    digest = hashlib.sha1()
+    for name, tensor in backbone.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return {'backbone': backbone_name, 'backbone_hash': digest.hexdigest(), 'num_variants': num_variants}
+
+
+def build_feature_cache(backbone, train_dir, valid_dir, cache_dir, num_variants=1, signature=None, **kwargs):
+    """
+    为训练集和验证集建立特征缓存
+
+    训练集第 0 个版本不做随机增强，其余 num_variants - 1 个版本使用训练增强；验证集只保存一个版本。
+    全部提取完成后把 signature 写入 cache_dir/manifest.json，供 is_feature_cache_ready 检查
+    """
+    signature_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if os.path.exists(signature_path):
+        # 先删除旧签名，提取中途退出时不会把不完整的缓存当作可用
+        os.remove(signature_path)
+    data_transforms = get_data_transforms()
+    train_dataset = datasets.ImageFolder(train_dir, transform=data_transforms['valid'])
+    valid_dataset = datasets.ImageFolder(valid_dir, transform=data_transforms['valid'])
+
+    extract_features(backbone, train_dataset, os.path.join(cache_dir, 'train'), num_variants=1, **kwargs)
+    augmented_dir = os.path.join(cache_dir, 'train_augmented')
+    if num_variants > 1:
+        augmented_dataset = datasets.ImageFolder(train_dir, transform=data_transforms['train'])
+        extract_features(backbone, augmented_dataset, augmented_dir,
+                         num_variants=num_variants - 1, seed=1, **kwargs)
+    else:
+        # 版本数减少到 1 时删除旧的增强版本，否则 get_feature_loaders 仍会读取
+        shutil.rmtree(augmented_dir, ignore_errors=True)
+    extract_features(backbone, valid_dataset, os.path.join(cache_dir, 'valid'), num_variants=1, **kwargs)
+
+    with open(signature_path, 'w') as f:
+        json.dump(signature or {'num_variants': num_variants}, f, ensure_ascii=False, indent=2)
+
+
+def is_feature_cache_ready(cache_dir, signature=None):
+    """
+    缓存完整且签名（backbone、权重和版本数）与 signature 一致时返回 True
+    """
+    signature_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not all(os.path.exists(os.path.join(cache_dir, split, MANIFEST_NAME)) for split in ('train', 'valid')):
+        return False
+    if not os.path.exists(signature_path):
+        print(f"特征缓存 {cache_dir} 没有签名（旧版本或提取未完成），需要重建")
+        return False
+    with open(signature_path) as f:
+        cached = json.load(f)
+    if signature is not None and cached != signature:
+        changed = [key for key in signature if cached.get(key) != signature[key]]
+        print(f"特征缓存 {cache_dir} 已过期（{', '.join(changed)} 不一致），需要重建")
+        return False
+    return True
+
+
+class FeatureCacheDataset(Dataset):
+    """
+    从内存映射的特征缓存中读取样本；有多个增强版本时每次随机选择一个版本
+    """
+
+    def __init__(self, *split_dirs, random_variant=False):
+        self.features = []
+        for split_dir in split_dirs:
+            with open(os.path.join(split_dir, MANIFEST_NAME)) as f:
+                self.manifest = json.load(f)
+            self.features.append(np.load(os.path.join(split_dir, 'features.npy'), mmap_mode='r'))
+        self.labels = torch.from_numpy(np.load(os.path.join(split_dirs[0], 'labels.npy')))
+        self.classes = self.manifest['classes']
+        # 所有版本展开成一个列表: (数组下标, 版本下标)
+        self.variants = [(i, v) for i, array in enumerate(self.features) for v in range(array.shape[0])]
+        self.random_variant = random_variant
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self.random_variant:
+            array_idx, variant = self.variants[torch.randint(len(self.variants), ()).item()]
+        else:
+            array_idx, variant = self.variants[0]
+        feature = torch.from_numpy(np.asarray(self.features[array_idx][variant, index], dtype=np.float32))
+        return feature, self.labels[index]
+
+
+def get_feature_loaders(cache_dir, batch_size=256, num_workers=0):
+    """
+    获取基于特征缓存的训练和验证数据加载器，返回格式与 get_data_loaders 相同
+    """
+    train_dirs = [os.path.join(cache_dir, 'train')]
+    augmented_dir = os.path.join(cache_dir, 'train_augmented')
+    if os.path.exists(os.path.join(augmented_dir, MANIFEST_NAME)):
+        train_dirs.append(augmented_dir)
+
+    train_dataset = FeatureCacheDataset(*train_dirs, random_variant=True)
+    valid_dataset = FeatureCacheDataset(os.path.join(cache_dir, 'valid'))
+
+    dataloaders = {
+        'train': DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers),
+        'valid': DataLoader(valid_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers),
+    }
+    return dataloaders, train_dataset.classes
@@ -0,0 +1,118 @@
+# src/utils/feature_capture.py
+
+import contextlib
+import os
+import resource
+
+import torch
+
+
+class FeatureCapture:
+    """
+    只截取选中样本在选中层的输出，用于评估时可视化特征图
+
+    平时不在模型上注册任何 hook；只有当前批次包含选中的样本时，才在选中的层上注册 forward hook，
+    hook 把这些样本对应的切片 detach 后拷贝到 CPU，前向结束后立即移除。
+    整个评估过程中不会一直引用整批的全分辨率中间激活
+
+    用法:
+        capture = FeatureCapture(model, ['layer1', 'layer2'], sample_indices=[0])
+        for inputs, labels in loader:
+            with capture.batch(start, inputs.size(0)) as rows:
+                outputs = model(inputs)
+            for position, sample_idx in rows:
+                features = capture.pop(sample_idx)  # {层名称: CPU 张量 (C, H, W)}
+            start += inputs.size(0)
+    """
+
+    def __init__(self, model, layer_names, sample_indices=(0,)):
+        modules = dict(model.named_modules())
+        self.layers = {}
+        for layer_name in layer_names:
+            if layer_name in modules:
+                self.layers[layer_name] = modules[layer_name]
+            else:
+                print(f"层 {layer_name} 不存在于模型中。")
+        self.sample_indices = sorted(set(sample_indices))
+        # {样本下标: {层名称: CPU 张量}}
+        self.features = {}
+        self.captured_bytes = 0
+
+    def rows_in_batch(self, start, batch_size):
+        """
+        返回批次 [start, start + batch_size) 中需要截取的样本 [(批内位置, 样本下标)]
+        """
+        return [(idx - start, idx) for idx in self.sample_indices if start <= idx < start + batch_size]
+
+    @contextlib.contextmanager
+    def batch(self, start, batch_size):
+        """
+        在 with 块内的前向中截取当前批次的选中样本；批次中没有选中样本时不注册 hook
+        """
+        rows = self.rows_in_batch(start, batch_size)
+        handles = []
+        if rows:
+            handles = [layer.register_forward_hook(self._make_hook(layer_name, rows))
+                       for layer_name, layer in self.layers.items()]
+        try:
+            yield rows
+        finally:
+            for handle in handles:
+                handle.remove()
+
+    def _make_hook(self, layer_name, rows):
+        positions = [position for position, _ in rows]
+
+        def hook(module, inputs, output):
+            # 按下标取行会生成新张量，只保留选中样本，不引用整批输出
+            selected = output.detach()[positions].cpu()
+            self.captured_bytes += selected.numel() * selected.element_size()
+            for (_, sample_idx), feature in zip(rows, selected):
+                self.features.setdefault(sample_idx, {})[layer_name] = feature
+
+        return hook
+
+    def pop(self, sample_idx):
+        """
+        取出并释放一个样本的特征 {层名称: 张量}
+        """
+        return self.features.pop(sample_idx, {})
+
+    def release(self):
+        self.features.clear()
+
+    def format_summary(self, device):
+        peak = peak_memory_mb(device)
+        return (f"截取 {len(self.sample_indices)} 张图片 × {len(self.layers)} 层，"
+                f"共 {self.captured_bytes / 2 ** 20:.1f}MB；峰值内存 {peak:.0f}MB")
+
+
+def peak_memory_mb(device):
+    """
+    CUDA 上为 max_memory_allocated，CPU 上为进程的最大常驻内存（Linux 下 ru_maxrss 的单位是 KB）
+    """
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2 ** 20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_path(dataset, index):
+    """
+    返回数据集第 index 个样本的图片路径；只有 ImageFolder 等带 samples 列表的数据集有路径，
+    解码缓存和 tar 分片返回 None
+    """
+    samples = getattr(dataset, 'samples', None)
+    if samples is None:
+        return None
+    return samples[index][0]
+
+
+def sample_name(dataset, index):
+    """
+    用于保存文件的样本名称：有路径时为不带扩展名的文件名，否则为 sample_<下标>
+    """
+    path = sample_path(dataset, index)
+    if path is None:
+        return f'sample_{index:05d}'
+    return os.path.splitext(os.path.basename(path))[0]
@@ -0,0 +1,60 @@
+# src/utils/loader_stats.py
+
+import time
+
+
+class LoaderStallMonitor:
+    """
+    记录每个批次的数据等待时间和计算时间，用于判断瓶颈是否在数据加载
+
+    用法:
+        monitor = LoaderStallMonitor()
+        for inputs, labels in monitor.wrap(loader):
+            ...  # 前向、反向计算
+        print(monitor.summary())
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.data_times = []
+        self.compute_times = []
+
+    def wrap(self, loader):
+        iterator = iter(loader)
+        start = time.perf_counter()
+        while True:
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            fetched = time.perf_counter()
+            self.data_times.append(fetched - start)
+            yield batch
+            # 生成器恢复时说明调用方已完成这个批次的计算
+            start = time.perf_counter()
+            self.compute_times.append(start - fetched)
+
+    def summary(self):
+        data_time = sum(self.data_times)
+        compute_time = sum(self.compute_times)
+        total = data_time + compute_time
+        return {
+            'batches': len(self.data_times),
+            'data_time': data_time,
+            'compute_time': compute_time,
+            'data_wait_ratio': data_time / total if total > 0 else 0.0,
+            'max_data_time': max(self.data_times, default=0.0),
+        }
+
+    def format_summary(self):
+        stats = self.summary()
+        return (f"数据等待 {stats['data_time']:.1f}s / 计算 {stats['compute_time']:.1f}s "
+                f"(等待占比 {stats['data_wait_ratio']:.1%}，单批最长等待 {stats['max_data_time'] * 1000:.0f}ms)")
+
+    def log_to_tensorboard(self, writer, phase, epoch):
+        stats = self.summary()
+        writer.add_scalar(f'DataLoader/{phase}_data_time', stats['data_time'], epoch)
+        writer.add_scalar(f'DataLoader/{phase}_compute_time', stats['compute_time'], epoch)
+        writer.add_scalar(f'DataLoader/{phase}_data_wait_ratio', stats['data_wait_ratio'], epoch)
@@ -1,6 +1,7 @@
 # src/utils/metrics.py
 
 import torch
+import torch.distributed as dist
 
 def calculate_accuracy(outputs, labels):
     """
@@ -9,4 +10,80 @@ def calculate_accuracy(outputs, labels):
     _, preds = torch.max(outputs, 1)
     corrects = torch.sum(preds == labels.data)
     acc = corrects.double() / labels.size(0)
-    return acc
\ No newline at end of file
+    return acc
+
+
+class MetricAccumulator:
+    """
+    在模型所在设备上累加损失、top-k 正确数和混淆矩阵
+
+    update 只做张量运算，不调用 .item()，不会每个批次都同步设备；
+    compute 在阶段结束时一次性把结果取回 CPU
+    """
+
+    def __init__(self, num_classes, topk=(1, 5), device='cpu'):
+        self.num_classes = num_classes
+        self.topk = topk
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.topk_correct = torch.zeros(len(self.topk), dtype=torch.long, device=self.device)
+        # confusion[i, j]: 真实类别为 i、预测为 j 的样本数
+        self.confusion = torch.zeros(self.num_classes, self.num_classes, dtype=torch.long, device=self.device)
+
+    @torch.no_grad()
+    def update(self, outputs, labels, loss=None):
+        """
+        累加一个批次；loss 为该批次的平均损失
+        """
+        batch_size = labels.size(0)
+        self.count += batch_size
+        if loss is not None:
+            self.loss_sum += loss.detach().double() * batch_size
+
+        max_k = min(max(self.topk), self.num_classes)
+        top_preds = outputs.topk(max_k, dim=1).indices
+        hits = top_preds == labels.unsqueeze(1)
+        self.topk_correct += torch.stack([hits[:, :k].any(dim=1).sum() for k in self.topk])
+
+        # bincount 在 CUDA 上需要把 min/max 取回主机确定输出长度；index_add_ 直接累加到展平的混淆矩阵，不会同步
+        indices = labels * self.num_classes + top_preds[:, 0]
+        self.confusion.view(-1).index_add_(0, indices, torch.ones_like(indices))
+
+    def all_reduce(self):
+        """
+        多进程训练时把各进程的累加结果求和，之后每个进程 compute() 得到的都是全局结果；单进程时不做任何事
+        """
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        count = torch.tensor(self.count, dtype=torch.long, device=self.device)
+        for tensor in (count, self.loss_sum, self.topk_correct, self.confusion):
+            dist.all_reduce(tensor)
+        self.count = int(count.item())
+
+    def compute(self):
+        """
+        返回损失、top-k 准确率、每类样本数、精确率、召回率和混淆矩阵（numpy 数组）
+        """
+        count = max(self.count, 1)
+        confusion = self.confusion.cpu()
+        topk_correct = self.topk_correct.cpu()
+        true_positives = confusion.diag().double()
+        support = confusion.sum(dim=1)
+        predicted = confusion.sum(dim=0)
+
+        results = {
+            'count': self.count,
+            'loss': self.loss_sum.item() / count,
+            'acc': true_positives.sum().item() / count,
+            'support': support.numpy(),
+            'precision': (true_positives / predicted.clamp(min=1)).numpy(),
+            'recall': (true_positives / support.clamp(min=1)).numpy(),
+            'confusion': confusion.numpy(),
+        }
+        for k, correct in zip(self.topk, topk_correct.tolist()):
+            results[f'top{k}_acc'] = correct / count
+        return results
@@ -0,0 +1,139 @@
+# src/utils/shard_cache.py
+
+import bisect
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets
+from tqdm import tqdm
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def source_fingerprint(dataset):
+    """
+    ImageFolder 数据集的指纹：按相对路径排序的 (路径, 文件大小, 修改时间, 类别) 和 class_to_idx 的 SHA-1
+
+    图片被增删、替换或改变类别时指纹随之变化，由此判断解码缓存 / tar 分片是否需要重建
+    """
+    root = os.path.abspath(dataset.root)
+    entries = []
+    for path, target in dataset.samples:
+        stat = os.stat(path)
+        entries.append([os.path.relpath(path, root), stat.st_size, stat.st_mtime_ns, target])
+    entries.sort()
+    payload = json.dumps({'class_to_idx': dataset.class_to_idx, 'samples': entries}, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def is_source_current(manifest, image_dir, name):
+    """
+    manifest 中记录的源目录指纹与 image_dir 当前内容一致时返回 True，不一致时打印提示
+    """
+    if image_dir is None:
+        return True
+    if manifest.get('source') != source_fingerprint(datasets.ImageFolder(image_dir)):
+        print(f"{name} 与 {image_dir} 的内容不一致（图片或类别有变化），需要重建")
+        return False
+    return True
+
+
+def build_shard_cache(image_dir, output_dir, size=(224, 224), shard_size=2048):
+    """
+    将 ImageFolder 目录中的图片解码一次，缩放到固定大小后保存为 uint8 分片
+
+    每个分片 shard_xxxxx.npy 的形状为 (n, 3, H, W)，另存 labels.npy 和 manifest.json；
+    manifest.json 中记录源目录的指纹，最后写入
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        # 先删除旧清单，解码中途退出时不会把不完整的缓存当作可用
+        os.remove(manifest_path)
+    dataset = datasets.ImageFolder(image_dir)
+    width, height = size
+    num_samples = len(dataset.samples)
+
+    shards = []
+    for start in tqdm(range(0, num_samples, shard_size), desc=f'解码 {image_dir}'):
+        samples = dataset.samples[start:start + shard_size]
+        file_name = f'shard_{len(shards):05d}.npy'
+        shard = np.lib.format.open_memmap(os.path.join(output_dir, file_name), mode='w+',
+                                          dtype=np.uint8, shape=(len(samples), 3, height, width))
+        for i, (path, _) in enumerate(samples):
+            with Image.open(path) as image:
+                # 与 get_data_loaders 中的 Resize((224, 224)) 相同
+                image = image.convert('RGB').resize((width, height), Image.BILINEAR)
+            shard[i] = np.asarray(image).transpose(2, 0, 1)
+        shard.flush()
+        del shard
+        shards.append({'file': file_name, 'count': len(samples)})
+
+    np.save(os.path.join(output_dir, 'labels.npy'), np.array(dataset.targets, dtype=np.int64))
+    manifest = {
+        'num_samples': num_samples,
+        'size': [width, height],
+        'classes': dataset.classes,
+        'source': source_fingerprint(dataset),
+        'shards': shards,
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def is_shard_cache_ready(cache_dir, size=(224, 224), image_dir=None):
+    """
+    缓存完整、图片大小一致，且给出 image_dir 时源目录内容没有变化，返回 True
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest['size'] == list(size) and is_source_current(manifest, image_dir, f"解码缓存 {cache_dir}")
+
+
+class ShardDataset(Dataset):
+    """
+    从 uint8 分片中读取图片，返回 (C, H, W) 的 uint8 张量（零拷贝）和标签
+    """
+
+    def __init__(self, cache_dir, transform=None):
+        self.cache_dir = cache_dir
+        self.transform = transform
+        with open(os.path.join(cache_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.classes = manifest['classes']
+        self.shard_files = [shard['file'] for shard in manifest['shards']]
+        self.offsets = np.cumsum([0] + [shard['count'] for shard in manifest['shards']]).tolist()
+        self.targets = np.load(os.path.join(cache_dir, 'labels.npy')).tolist()
+        # 分片在首次访问时才打开，DataLoader 的每个 worker 各自映射，避免把数据序列化到子进程
+        self.shards = None
+
+    def _open_shards(self):
+        # 'c' 为写时复制映射，torch.from_numpy 可以直接共享内存而不会产生只读警告
+        self.shards = [np.load(os.path.join(self.cache_dir, file_name), mmap_mode='c')
+                       for file_name in self.shard_files]
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            self._open_shards()
+        shard_idx = bisect.bisect_right(self.offsets, index) - 1
+        image = torch.from_numpy(self.shards[shard_idx][index - self.offsets[shard_idx]])
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[index]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = None
+        return state
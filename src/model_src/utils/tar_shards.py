@@ -0,0 +1,228 @@
+# src/utils/tar_shards.py
+
+import io
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import tarfile
+
+import torch
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision import datasets
+from tqdm import tqdm
+
+from .shard_cache import is_source_current, source_fingerprint
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def pack_tar_shards(image_dir, output_dir, shard_size=1000, seed=0):
+    """
+    将 ImageFolder 目录打包成 WebDataset 风格的 tar 分片
+
+    每个样本在 tar 中占两个文件：<key>.<原扩展名> 为原始图片字节，<key>.cls 为类别下标。
+    打包前先打乱样本顺序，使每个分片内都混有各个类别。manifest.json 中记录源目录的指纹，最后写入
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        # 先删除旧清单，打包中途退出时不会把不完整的分片当作可用
+        os.remove(manifest_path)
+    dataset = datasets.ImageFolder(image_dir)
+    samples = list(dataset.samples)
+    random.Random(seed).shuffle(samples)
+
+    shards = []
+    for start in tqdm(range(0, len(samples), shard_size), desc=f'打包 {image_dir}'):
+        file_name = f'shard-{len(shards):05d}.tar'
+        shard_samples = samples[start:start + shard_size]
+        with tarfile.open(os.path.join(output_dir, file_name), 'w') as tar:
+            for i, (path, target) in enumerate(shard_samples, start):
+                key = f'{i:08d}'
+                ext = os.path.splitext(path)[1].lower() or '.jpg'
+                with open(path, 'rb') as f:
+                    _add_bytes(tar, key + ext, f.read())
+                _add_bytes(tar, key + '.cls', str(target).encode())
+        shards.append({'file': file_name, 'count': len(shard_samples)})
+
+    manifest = {
+        'num_samples': len(samples),
+        'classes': dataset.classes,
+        'source': source_fingerprint(dataset),
+        'shards': shards,
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def is_tar_shards_ready(shard_dir, image_dir=None):
+    """
+    分片已打包完成，且给出 image_dir 时源目录内容没有变化，返回 True
+    """
+    manifest_path = os.path.join(shard_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        return is_source_current(json.load(f), image_dir, f"tar 分片 {shard_dir}")
+
+
+def _rank_and_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def iter_tar_samples(path):
+    """
+    顺序读取一个 tar 分片，按 key 组装 (图片字节, 类别下标)
+    """
+    current_key, image_bytes, target = None, None, None
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = os.path.splitext(member.name)
+            if key != current_key:
+                if image_bytes is not None and target is not None:
+                    yield image_bytes, target
+                current_key, image_bytes, target = key, None, None
+            data = tar.extractfile(member).read()
+            if ext == '.cls':
+                target = int(data)
+            else:
+                image_bytes = data
+        if image_bytes is not None and target is not None:
+            yield image_bytes, target
+
+
+class TarShardDataset(IterableDataset):
+    """
+    顺序读取 tar 分片的流式数据集
+
+    每个 epoch 打乱分片顺序，并在内存缓冲区内做样本级打乱；
+    分片按 (进程 rank, DataLoader worker) 切分，每个分片在一个 epoch 中只被读取一次。
+
+    多进程训练时各进程分到的分片样本数不同，样本少的进程会提前结束，DDP 的梯度同步会一直等待。
+    balance_ranks=True 时每个进程固定输出 ceil(样本数 / 进程数) 个样本：超出的截断，
+    不足的从其他分片循环补齐（与 DistributedSampler 一样会重复少量样本）。
+    验证集不需要梯度同步，应使用 balance_ranks=False，保证每个样本恰好被评估一次
+    """
+
+    def __init__(self, shard_dir, transform=None, shuffle=True, shuffle_buffer=1000, seed=0, balance_ranks=True):
+        with open(os.path.join(shard_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.shard_paths = [os.path.join(shard_dir, shard['file']) for shard in manifest['shards']]
+        self.classes = manifest['classes']
+        self.num_samples = manifest['num_samples']
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.balance_ranks = balance_ranks
+        # set_epoch 在主进程中调用，persistent_workers 的 worker 持有数据集的副本，
+        # 普通属性传不过去；共享内存中的值在 worker 中也能读到。-1 表示未设置
+        self.epoch = mp.RawValue('q', -1)
+        # 本副本被迭代的次数：未调用 set_epoch 时，persistent worker 的 base seed 不变，靠它区分 epoch
+        self.generation = 0
+
+    def set_epoch(self, epoch):
+        """
+        每个 epoch 开始前调用（在创建 DataLoader 迭代器之前），各进程使用相同的分片顺序
+        """
+        self.epoch.value = epoch
+
+    def __len__(self):
+        """
+        当前进程的样本数
+        """
+        _, world_size = _rank_and_world_size()
+        return math.ceil(self.num_samples / world_size)
+
+    def _epoch_seed(self):
+        self.generation += 1
+        if self.epoch.value >= 0:
+            return self.seed + self.epoch.value
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            # 同一次迭代中所有 worker 的 base seed 相同，保证分片顺序一致；
+            # 所有 worker 的迭代次数也相同，persistent worker 每个 epoch 仍会得到新的顺序
+            return worker_info.seed - worker_info.id + self.generation
+        return int(torch.randint(2 ** 31, ()))
+
+    def _split_samples(self, seed):
+        """
+        按 (进程 rank, DataLoader worker) 切分分片，逐个输出本 worker 的 (图片字节, 类别下标)
+        """
+        shard_paths = list(self.shard_paths)
+        if self.shuffle:
+            random.Random(seed).shuffle(shard_paths)
+
+        rank, world_size = _rank_and_world_size()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+
+        split = rank * num_workers + worker_id
+        num_splits = world_size * num_workers
+        assigned = shard_paths[split::num_splits]
+
+        if world_size == 1 or not self.balance_ranks:
+            if len(shard_paths) < num_splits:
+                print(f"警告: 分片数 ({len(shard_paths)}) 少于读取进程数 ({num_splits})，部分进程没有数据")
+            for path in assigned:
+                yield from iter_tar_samples(path)
+            return
+
+        # 每个进程的样本数相同，再平分给本进程的各个 worker；各进程的 worker 数相同，批次数也就相同
+        per_rank = len(self)
+        quota = per_rank // num_workers + (1 if worker_id < per_rank % num_workers else 0)
+        # 先读自己的分片，不够时从下一个分片开始循环读取补齐
+        start = split % len(shard_paths)
+        refill = itertools.cycle(shard_paths[start:] + shard_paths[:start])
+        count = 0
+        for path in itertools.chain(assigned, refill):
+            for sample in iter_tar_samples(path):
+                if count >= quota:
+                    return
+                yield sample
+                count += 1
+
+    def _decode(self, image_bytes, target):
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = image.convert('RGB')
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
+
+    def __iter__(self):
+        seed = self._epoch_seed()
+        worker_info = get_worker_info()
+        rng = random.Random(seed + (worker_info.id if worker_info else 0))
+
+        buffer = []
+        for sample in self._split_samples(seed):
+            if not self.shuffle:
+                yield self._decode(*sample)
+                continue
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            # 缓冲区已满：随机取出一个样本输出，并用新样本替换
+            index = rng.randrange(len(buffer))
+            buffer[index], sample = sample, buffer[index]
+            yield self._decode(*sample)
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._decode(*sample)
@@ -1,10 +1,123 @@
 # src/utils/visualization.py
 
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
 import pandas as pd
+import torch
+from PIL import Image
+from torchvision.transforms.functional import to_pil_image
+from torchvision.utils import make_grid
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
 
 def save_metrics_to_csv(metrics, csv_path):
     """
     将训练和验证的指标保存到 CSV 文件
     """
     df = pd.DataFrame(metrics)
-    df.to_csv(csv_path, index=False)
\ No newline at end of file
+    df.to_csv(csv_path, index=False)
+
+
+def denormalize_image(image_tensor):
+    """
+    把按 ImageNet 均值和标准差归一化的 (3, H, W) 张量还原为 PIL 图片
+    """
+    image = image_tensor.detach().float().cpu()
+    mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(3, 1, 1)
+    return to_pil_image((image * std + mean).clamp(0, 1))
+
+
+def normalize_channels(feature):
+    """
+    把 (C, H, W) 特征图的每个通道各自归一化到 [0, 1]，所有通道一次完成
+    """
+    flat = feature.detach().float().flatten(1)
+    low = flat.min(dim=1, keepdim=True).values
+    high = flat.max(dim=1, keepdim=True).values
+    return ((flat - low) / (high - low).clamp_min(1e-8)).view(feature.shape)
+
+
+def make_feature_grid(feature, padding=1):
+    """
+    把 (C, H, W) 特征图的所有通道拼成一张接近正方形的网格，返回 ((H', W') 张量, 每行通道数)
+    """
+    nrow = math.ceil(math.sqrt(feature.size(0)))
+    grid = make_grid(normalize_channels(feature).unsqueeze(1), nrow=nrow, padding=padding)
+    return grid[0], nrow
+
+
+def _write_grid(rgb, path, index=None):
+    Image.fromarray(rgb).save(path)
+    if index is not None:
+        with open(os.path.splitext(path)[0] + '_index.json', 'w') as f:
+            json.dump(index, f, ensure_ascii=False)
+
+
+class FeatureGridExporter:
+    """
+    每层特征图保存为一张网格 PNG（而不是每个通道一张图），并在 TensorBoard 中每层记录一张图片
+
+    PNG 编码和写文件在后台线程池中进行；index=True 时在 PNG 旁另存 <名称>_index.json，
+    记录每个通道在网格中的位置和归一化前的取值范围。结束时调用 close() 等待所有文件写完
+    """
+
+    def __init__(self, output_dir, writer=None, index=False, padding=1, cmap='viridis', max_workers=4):
+        self.output_dir = output_dir
+        self.writer = writer
+        self.index = index
+        self.padding = padding
+        self.cmap = matplotlib.colormaps[cmap]
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def export(self, feature, layer_name, img_name):
+        """
+        feature 为一张图片在某一层的 (C, H, W) 输出，写入 <output_dir>/<层名称>/<图片名>_<层名称>.png
+        """
+        feature = feature.detach().cpu()
+        grid, nrow = make_feature_grid(feature, self.padding)
+        rgb = self.cmap(grid.numpy(), bytes=True)[..., :3]
+
+        if self.writer is not None:
+            self.writer.add_image(f'{layer_name}/{img_name}', rgb, dataformats='HWC')
+
+        index = None
+        if self.index:
+            flat = feature.float().flatten(1)
+            height, width = feature.shape[1:]
+            index = {
+                'layer': layer_name,
+                'image': img_name,
+                'tile_height': height,
+                'tile_width': width,
+                'padding': self.padding,
+                'channels': [
+                    {'channel': c, 'x': self.padding + (c % nrow) * (width + self.padding),
+                     'y': self.padding + (c // nrow) * (height + self.padding), 'min': low, 'max': high}
+                    for c, (low, high) in enumerate(zip(flat.min(dim=1).values.tolist(),
+                                                        flat.max(dim=1).values.tolist()))
+                ],
+            }
+
+        layer_dir = os.path.join(self.output_dir, layer_name)
+        os.makedirs(layer_dir, exist_ok=True)
+        path = os.path.join(layer_dir, f'{img_name}_{layer_name}.png')
+        self.futures.append(self.executor.submit(_write_grid, rgb, path, index))
+        return path
+
+    def close(self):
+        """
+        等待所有 PNG 写完，写入失败时抛出异常
+        """
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures = []
+            self.executor.shutdown()